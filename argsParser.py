@@ -1,4 +1,8 @@
 import argparse
+import math
+from imuSerializer import IMU_FORMATS, IMU_FORMAT_JSON, IMU_PRECISIONS, IMU_PRECISION_F32
+from ringBuffer    import POLICIES, POLICY_DROP_OLDEST
+from frameRecorder import CONTAINERS, CONTAINER_RAW
 
 '''
 * @author: vladddd46
@@ -10,6 +14,28 @@ import argparse
 
 
 
+def positiveInt(value):
+	'''Type of flags, which must be integer greater than 0.'''
+	try:
+		number = int(value)
+	except ValueError:
+		raise argparse.ArgumentTypeError("invalid int value: '%s'" % value)
+	if number < 1:
+		raise argparse.ArgumentTypeError("must be positive: %d" % number)
+	return number
+
+
+def positiveFloat(value):
+	'''Type of flags, which must be finite number greater than 0.'''
+	try:
+		number = float(value)
+	except ValueError:
+		raise argparse.ArgumentTypeError("invalid float value: '%s'" % value)
+	if not math.isfinite(number) or number <= 0:
+		raise argparse.ArgumentTypeError("must be positive and finite: %s" % value)
+	return number
+
+
 def parseArguments():
 	argparser = argparse.ArgumentParser(description='Simulation of motorbike falling')
 	argparser.add_argument(
@@ -62,6 +88,86 @@ def parseArguments():
 		type=int,
 		help='defines, wether drawer-sender module must be on'
 	)
+	argparser.add_argument(
+		'--imu_format',
+		default=IMU_FORMAT_JSON,
+		choices=IMU_FORMATS,
+		help='format of imu data sent to balancer: json (default) or fixed-layout binary frame'
+	)
+	argparser.add_argument(
+		'--imu_precision',
+		default=IMU_PRECISION_F32,
+		choices=IMU_PRECISIONS,
+		help='precision of fields in binary imu frame (default: f32)'
+	)
+	argparser.add_argument(
+		'--imu_queue_policy',
+		default=POLICY_DROP_OLDEST,
+		choices=POLICIES,
+		help='what to do with imu data, when balancer link stalls: keep newest --imu_queue_size samples (drop_oldest, default) or only the newest one (latest_only)'
+	)
+	argparser.add_argument(
+		'--imu_queue_size',
+		default=64,
+		type=positiveInt,
+		help='capacity of imu data queue for drop_oldest policy (default: 64)'
+	)
+	argparser.add_argument(
+		'--latency_csv',
+		default=None,
+		help='csv file, percentiles of control-loop round trip time are appended to (default: not written)'
+	)
+	argparser.add_argument(
+		'--latency_period',
+		default=1.0,
+		type=positiveFloat,
+		help='period in seconds of publishing control-loop round trip percentiles (default: 1.0)'
+	)
+	argparser.add_argument(
+		'--sync',
+		action='store_true',
+		help='run world in synchronous mode with fixed time step: every tick waits for steer-angle from balancer'
+	)
+	argparser.add_argument(
+		'--delta_seconds',
+		default=0.05,
+		type=float,
+		help='fixed time step of synchronous mode in seconds (default: 0.05)'
+	)
+	argparser.add_argument(
+		'--sync_timeout',
+		default=1.0,
+		type=float,
+		help='how long synchronous mode waits for imu sample and steer-angle in seconds (default: 1.0)'
+	)
+	argparser.add_argument(
+		'--headless',
+		action='store_true',
+		help='run without window, camera and server-side rendering: only imu data and steer-angles are exchanged'
+	)
+	argparser.add_argument(
+		'--camera_workers',
+		default=1,
+		type=int,
+		help='count of threads, which decode camera/lidar/dvs frames (default: 1)'
+	)
+	argparser.add_argument(
+		'--record_format',
+		default=CONTAINER_RAW,
+		choices=CONTAINERS,
+		help='container of recorded frames: chunked raw frames with index (raw, default) or compressed archive (zip)'
+	)
+	argparser.add_argument(
+		'--record_dir',
+		default='_out',
+		help='directory recording sessions are written to (default: _out)'
+	)
+	argparser.add_argument(
+		'--record_queue',
+		default=64,
+		type=positiveInt,
+		help='count of frames waiting to be written; newer frames are dropped, when it is full (default: 64)'
+	)
 	argparser.add_argument(
 		'-v', '--verbose',
 		action='store_true',
@@ -13,7 +13,7 @@ import math
 from enum import Enum
 
 import carla
-from agents.tools.misc import is_within_distance_ahead, is_within_distance, compute_distance
+from agents.tools.misc import is_within_distance_ahead, is_within_distance, compute_distance, EgoSnapshot
 
 class AgentState(Enum):
     """
@@ -46,11 +46,24 @@ class Agent(object):
             print('  Make sure it exists, has the same name of your town, and is correct.')
             sys.exit(1)
         self._last_traffic_light = None
+        self._ego_snapshot = None
 
     def get_local_planner(self):
         """Get method for protected member local planner"""
         return self._local_planner
 
+    def get_ego_snapshot(self):
+        """
+        Returns the EgoSnapshot of the vehicle for the current simulation frame.
+        It is captured by the first call of the frame, later calls reuse it.
+
+            :return: EgoSnapshot
+        """
+        frame = self._world.get_snapshot().frame
+        if self._ego_snapshot is None or self._ego_snapshot.frame != frame:
+            self._ego_snapshot = EgoSnapshot(self._vehicle, self._map, frame)
+        return self._ego_snapshot
+
     @staticmethod
     def run_step(debug=False):
         """
@@ -70,20 +83,23 @@ class Agent(object):
 
         return control
 
-    def _is_light_red(self, lights_list):
+    def _is_light_red(self, lights_list, ego=None):
         """
         Method to check if there is a red light affecting us. This version of
         the method is compatible with both European and US style traffic lights.
 
         :param lights_list: list containing TrafficLight objects
+        :param ego: EgoSnapshot of the vehicle for this step, if None the state
+            is queried from the vehicle
         :return: a tuple given by (bool_flag, traffic_light), where
                  - bool_flag is True if there is a traffic light in RED
                    affecting us and False otherwise
                  - traffic_light is the object itself or None if there is no
                    red traffic light affecting us
         """
-        ego_vehicle_location = self._vehicle.get_location()
-        ego_vehicle_waypoint = self._map.get_waypoint(ego_vehicle_location)
+        if ego is None:
+            ego = EgoSnapshot(self._vehicle, self._map)
+        ego_vehicle_waypoint = ego.waypoint
 
         for traffic_light in lights_list:
             object_location = self._get_trafficlight_trigger_location(traffic_light)
@@ -100,7 +116,7 @@ class Agent(object):
                 continue
 
             if is_within_distance_ahead(object_waypoint.transform,
-                                        self._vehicle.get_transform(),
+                                        ego.transform,
                                         self._proximity_tlight_threshold):
                 if traffic_light.state == carla.TrafficLightState.Red:
                     return (True, traffic_light)
@@ -131,7 +147,7 @@ class Agent(object):
         return carla.Location(point_location.x, point_location.y, point_location.z)
 
     def _bh_is_vehicle_hazard(self, ego_wpt, ego_loc, vehicle_list,
-                           proximity_th, up_angle_th, low_angle_th=0, lane_offset=0):
+                           proximity_th, up_angle_th, low_angle_th=0, lane_offset=0, ego=None):
         """
         Check if a given vehicle is an obstacle in our way. To this end we take
         into account the road and lane the target vehicle is on and run a
@@ -154,6 +170,8 @@ class Agent(object):
             :param up_angle_th: upper threshold for angle
             :param low_angle_th: lower threshold for angle
             :param lane_offset: for right and left lane changes
+            :param ego: EgoSnapshot of the vehicle for this step, if None the
+            heading is queried from the vehicle
             :return: a tuple given by (bool_flag, vehicle, distance), where:
             - bool_flag is True if there is a vehicle ahead blocking us
                    and False otherwise
@@ -165,6 +183,8 @@ class Agent(object):
         if ego_wpt.lane_id < 0 and lane_offset != 0:
             lane_offset *= -1
 
+        ego_transform = ego.transform if ego is not None else self._vehicle.get_transform()
+
         for target_vehicle in vehicle_list:
 
             target_vehicle_loc = target_vehicle.get_location()
@@ -179,29 +199,33 @@ class Agent(object):
                     continue
 
             if is_within_distance(target_vehicle_loc, ego_loc,
-                                  self._vehicle.get_transform().rotation.yaw,
+                                  ego_transform.rotation.yaw,
                                   proximity_th, up_angle_th, low_angle_th):
 
                 return (True, target_vehicle, compute_distance(target_vehicle_loc, ego_loc))
 
         return (False, None, -1)
 
-    def _is_vehicle_hazard(self, vehicle_list):
+    def _is_vehicle_hazard(self, vehicle_list, ego=None):
         """
         :param vehicle_list: list of potential obstacle to check
+        :param ego: EgoSnapshot of the vehicle for this step, if None the state
+            is queried from the vehicle
         :return: a tuple given by (bool_flag, vehicle), where
                  - bool_flag is True if there is a vehicle ahead blocking us
                    and False otherwise
                  - vehicle is the blocker object itself
         """
 
-        ego_vehicle_transform = self._vehicle.get_transform()
+        if ego is None:
+            ego = EgoSnapshot(self._vehicle, self._map)
+        ego_vehicle_transform = ego.transform
         ego_vehicle_forward_vector = ego_vehicle_transform.get_forward_vector()
         ego_vehicle_extent = self._vehicle.bounding_box.extent.x
-        ego_vehicle_waypoint = self._map.get_waypoint(self._vehicle.get_location())
+        ego_vehicle_waypoint = ego.waypoint
 
-        # Get the transform of the front of the ego
-        ego_vehicle_front_transform = ego_vehicle_transform
+        # Get the transform of the front of the ego (a copy, the snapshot is shared)
+        ego_vehicle_front_transform = carla.Transform(ego_vehicle_transform.location, ego_vehicle_transform.rotation)
         ego_vehicle_front_transform.location += carla.Location(
             x=ego_vehicle_extent * ego_vehicle_forward_vector.x,
             y=ego_vehicle_extent * ego_vehicle_forward_vector.y,
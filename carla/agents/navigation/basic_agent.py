@@ -93,8 +93,11 @@ class BasicAgent(Agent):
         vehicle_list = actor_list.filter("*vehicle*")
         lights_list = actor_list.filter("*traffic_light*")
 
+        # state of the ego vehicle shared by every check of this step
+        ego = self.get_ego_snapshot()
+
         # check possible obstacles
-        vehicle_state, vehicle = self._is_vehicle_hazard(vehicle_list)
+        vehicle_state, vehicle = self._is_vehicle_hazard(vehicle_list, ego)
         if vehicle_state:
             if debug:
                 print('!!! VEHICLE BLOCKING AHEAD [{}])'.format(vehicle.id))
@@ -103,7 +106,7 @@ class BasicAgent(Agent):
             hazard_detected = True
 
         # check for the state of the traffic lights
-        light_state, traffic_light = self._is_light_red(lights_list)
+        light_state, traffic_light = self._is_light_red(lights_list, ego)
         if light_state:
             if debug:
                 print('=== RED LIGHT AHEAD [{}])'.format(traffic_light.id))
@@ -116,7 +119,7 @@ class BasicAgent(Agent):
         else:
             self._state = AgentState.NAVIGATING
             # standard local planner behavior
-            control = self._local_planner.run_step(debug=debug)
+            control = self._local_planner.run_step(debug=debug, ego=ego)
 
         return control
 
@@ -123,6 +123,8 @@ class BehaviorAgent(Agent):
         """
         This method implements re-routing for vehicles approaching its destination.
         It finds a new target and computes another path to reach it.
+        All candidate destinations are scored by one batched route query,
+        so a destination that cannot be reached is never picked.
 
             :param spawn_points: list of possible destinations for the agent
         """
@@ -130,20 +132,24 @@ class BehaviorAgent(Agent):
         print("Target almost reached, setting new destination...")
         random.shuffle(spawn_points)
         new_start = self._local_planner.waypoints_queue[-1][0].transform.location
-        destination = spawn_points[0].location if spawn_points[0].location != new_start else spawn_points[1].location
+        destinations = [point.location for point in spawn_points if point.location != new_start]
+
+        routes = self._get_global_route_planner().route_matrix([new_start], destinations)
+        reachable = np.flatnonzero(np.isfinite(routes.costs[0]))
+        if reachable.size == 0:
+            print("No reachable destination found")
+            return
+        destination = destinations[reachable[0]]
         print("New destination: " + str(destination))
 
-        self.set_destination(new_start, destination)
+        self.start_waypoint = self._map.get_waypoint(new_start)
+        self.end_waypoint = self._map.get_waypoint(destination)
+        self._local_planner.set_global_plan(routes.trace(0, reachable[0]))
 
-    def _trace_route(self, start_waypoint, end_waypoint):
+    def _get_global_route_planner(self):
         """
-        This method sets up a global router and returns the
-        optimal route from start_waypoint to end_waypoint.
-
-            :param start_waypoint: initial position
-            :param end_waypoint: final position
+        This method sets up the global router on first use and returns it.
         """
-        # Setting up global router
         if self._grp is None:
             wld = self.vehicle.get_world()
             dao = GlobalRoutePlannerDAO(
@@ -151,9 +157,18 @@ class BehaviorAgent(Agent):
             grp = GlobalRoutePlanner(dao)
             grp.setup()
             self._grp = grp
+        return self._grp
+
+    def _trace_route(self, start_waypoint, end_waypoint):
+        """
+        This method sets up a global router and returns the
+        optimal route from start_waypoint to end_waypoint.
 
+            :param start_waypoint: initial position
+            :param end_waypoint: final position
+        """
         # Obtain route plan
-        route = self._grp.trace_route(
+        route = self._get_global_route_planner().trace_route(
             start_waypoint.transform.location,
             end_waypoint.transform.location)
 
@@ -182,13 +197,14 @@ class BehaviorAgent(Agent):
             self.light_id_to_ignore = -1
         return 0
 
-    def _overtake(self, location, waypoint, vehicle_list):
+    def _overtake(self, location, waypoint, vehicle_list, ego=None):
         """
         This method is in charge of overtaking behaviors.
 
             :param location: current location of the agent
             :param waypoint: current waypoint of the agent
             :param vehicle_list: list of all the nearby vehicles
+            :param ego: EgoSnapshot of the agent for this step or None
         """
 
         left_turn = waypoint.left_lane_marking.lane_change
@@ -200,7 +216,7 @@ class BehaviorAgent(Agent):
         if (left_turn == carla.LaneChange.Left or left_turn ==
                 carla.LaneChange.Both) and waypoint.lane_id * left_wpt.lane_id > 0 and left_wpt.lane_type == carla.LaneType.Driving:
             new_vehicle_state, _, _ = self._bh_is_vehicle_hazard(waypoint, location, vehicle_list, max(
-                self.behavior.min_proximity_threshold, self.speed_limit / 3), up_angle_th=180, lane_offset=-1)
+                self.behavior.min_proximity_threshold, self.speed_limit / 3), up_angle_th=180, lane_offset=-1, ego=ego)
             if not new_vehicle_state:
                 print("Overtaking to the left!")
                 self.behavior.overtake_counter = 200
@@ -208,20 +224,21 @@ class BehaviorAgent(Agent):
                                      self.end_waypoint.transform.location, clean=True)
         elif right_turn == carla.LaneChange.Right and waypoint.lane_id * right_wpt.lane_id > 0 and right_wpt.lane_type == carla.LaneType.Driving:
             new_vehicle_state, _, _ = self._bh_is_vehicle_hazard(waypoint, location, vehicle_list, max(
-                self.behavior.min_proximity_threshold, self.speed_limit / 3), up_angle_th=180, lane_offset=1)
+                self.behavior.min_proximity_threshold, self.speed_limit / 3), up_angle_th=180, lane_offset=1, ego=ego)
             if not new_vehicle_state:
                 print("Overtaking to the right!")
                 self.behavior.overtake_counter = 200
                 self.set_destination(right_wpt.transform.location,
                                      self.end_waypoint.transform.location, clean=True)
 
-    def _tailgating(self, location, waypoint, vehicle_list):
+    def _tailgating(self, location, waypoint, vehicle_list, ego=None):
         """
         This method is in charge of tailgating behaviors.
 
             :param location: current location of the agent
             :param waypoint: current waypoint of the agent
             :param vehicle_list: list of all the nearby vehicles
+            :param ego: EgoSnapshot of the agent for this step or None
         """
 
         left_turn = waypoint.left_lane_marking.lane_change
@@ -231,12 +248,12 @@ class BehaviorAgent(Agent):
         right_wpt = waypoint.get_right_lane()
 
         behind_vehicle_state, behind_vehicle, _ = self._bh_is_vehicle_hazard(waypoint, location, vehicle_list, max(
-            self.behavior.min_proximity_threshold, self.speed_limit / 2), up_angle_th=180, low_angle_th=160)
+            self.behavior.min_proximity_threshold, self.speed_limit / 2), up_angle_th=180, low_angle_th=160, ego=ego)
         if behind_vehicle_state and self.speed < get_speed(behind_vehicle):
             if (right_turn == carla.LaneChange.Right or right_turn ==
                     carla.LaneChange.Both) and waypoint.lane_id * right_wpt.lane_id > 0 and right_wpt.lane_type == carla.LaneType.Driving:
                 new_vehicle_state, _, _ = self._bh_is_vehicle_hazard(waypoint, location, vehicle_list, max(
-                    self.behavior.min_proximity_threshold, self.speed_limit / 2), up_angle_th=180, lane_offset=1)
+                    self.behavior.min_proximity_threshold, self.speed_limit / 2), up_angle_th=180, lane_offset=1, ego=ego)
                 if not new_vehicle_state:
                     print("Tailgating, moving to the right!")
                     self.behavior.tailgate_counter = 200
@@ -244,20 +261,21 @@ class BehaviorAgent(Agent):
                                          self.end_waypoint.transform.location, clean=True)
             elif left_turn == carla.LaneChange.Left and waypoint.lane_id * left_wpt.lane_id > 0 and left_wpt.lane_type == carla.LaneType.Driving:
                 new_vehicle_state, _, _ = self._bh_is_vehicle_hazard(waypoint, location, vehicle_list, max(
-                    self.behavior.min_proximity_threshold, self.speed_limit / 2), up_angle_th=180, lane_offset=-1)
+                    self.behavior.min_proximity_threshold, self.speed_limit / 2), up_angle_th=180, lane_offset=-1, ego=ego)
                 if not new_vehicle_state:
                     print("Tailgating, moving to the left!")
                     self.behavior.tailgate_counter = 200
                     self.set_destination(left_wpt.transform.location,
                                          self.end_waypoint.transform.location, clean=True)
 
-    def collision_and_car_avoid_manager(self, location, waypoint):
+    def collision_and_car_avoid_manager(self, location, waypoint, ego=None):
         """
         This module is in charge of warning in case of a collision
         and managing possible overtaking or tailgating chances.
 
             :param location: current location of the agent
             :param waypoint: current waypoint of the agent
+            :param ego: EgoSnapshot of the agent for this step or None
             :return vehicle_state: True if there is a vehicle nearby, False if not
             :return vehicle: nearby vehicle
             :return distance: distance to nearby vehicle
@@ -270,39 +288,40 @@ class BehaviorAgent(Agent):
         if self.direction == RoadOption.CHANGELANELEFT:
             vehicle_state, vehicle, distance = self._bh_is_vehicle_hazard(
                 waypoint, location, vehicle_list, max(
-                    self.behavior.min_proximity_threshold, self.speed_limit / 2), up_angle_th=180, lane_offset=-1)
+                    self.behavior.min_proximity_threshold, self.speed_limit / 2), up_angle_th=180, lane_offset=-1, ego=ego)
         elif self.direction == RoadOption.CHANGELANERIGHT:
             vehicle_state, vehicle, distance = self._bh_is_vehicle_hazard(
                 waypoint, location, vehicle_list, max(
-                    self.behavior.min_proximity_threshold, self.speed_limit / 2), up_angle_th=180, lane_offset=1)
+                    self.behavior.min_proximity_threshold, self.speed_limit / 2), up_angle_th=180, lane_offset=1, ego=ego)
         else:
             vehicle_state, vehicle, distance = self._bh_is_vehicle_hazard(
                 waypoint, location, vehicle_list, max(
-                    self.behavior.min_proximity_threshold, self.speed_limit / 3), up_angle_th=30)
+                    self.behavior.min_proximity_threshold, self.speed_limit / 3), up_angle_th=30, ego=ego)
 
             # Check for overtaking
 
             if vehicle_state and self.direction == RoadOption.LANEFOLLOW and \
                     not waypoint.is_junction and self.speed > 10 \
                     and self.behavior.overtake_counter == 0 and self.speed > get_speed(vehicle):
-                self._overtake(location, waypoint, vehicle_list)
+                self._overtake(location, waypoint, vehicle_list, ego)
 
             # Check for tailgating
 
             elif not vehicle_state and self.direction == RoadOption.LANEFOLLOW \
                     and not waypoint.is_junction and self.speed > 10 \
                     and self.behavior.tailgate_counter == 0:
-                self._tailgating(location, waypoint, vehicle_list)
+                self._tailgating(location, waypoint, vehicle_list, ego)
 
         return vehicle_state, vehicle, distance
 
-    def pedestrian_avoid_manager(self, location, waypoint):
+    def pedestrian_avoid_manager(self, location, waypoint, ego=None):
         """
         This module is in charge of warning in case of a collision
         with any pedestrian.
 
             :param location: current location of the agent
             :param waypoint: current waypoint of the agent
+            :param ego: EgoSnapshot of the agent for this step or None
             :return vehicle_state: True if there is a walker nearby, False if not
             :return vehicle: nearby walker
             :return distance: distance to nearby walker
@@ -314,17 +333,17 @@ class BehaviorAgent(Agent):
 
         if self.direction == RoadOption.CHANGELANELEFT:
             walker_state, walker, distance = self._bh_is_vehicle_hazard(waypoint, location, walker_list, max(
-                self.behavior.min_proximity_threshold, self.speed_limit / 2), up_angle_th=90, lane_offset=-1)
+                self.behavior.min_proximity_threshold, self.speed_limit / 2), up_angle_th=90, lane_offset=-1, ego=ego)
         elif self.direction == RoadOption.CHANGELANERIGHT:
             walker_state, walker, distance = self._bh_is_vehicle_hazard(waypoint, location, walker_list, max(
-                self.behavior.min_proximity_threshold, self.speed_limit / 2), up_angle_th=90, lane_offset=1)
+                self.behavior.min_proximity_threshold, self.speed_limit / 2), up_angle_th=90, lane_offset=1, ego=ego)
         else:
             walker_state, walker, distance = self._bh_is_vehicle_hazard(waypoint, location, walker_list, max(
-                self.behavior.min_proximity_threshold, self.speed_limit / 3), up_angle_th=60)
+                self.behavior.min_proximity_threshold, self.speed_limit / 3), up_angle_th=60, ego=ego)
 
         return walker_state, walker, distance
 
-    def car_following_manager(self, vehicle, distance, debug=False):
+    def car_following_manager(self, vehicle, distance, debug=False, ego=None):
         """
         Module in charge of car-following behaviors when there's
         someone in front of us.
@@ -332,6 +351,7 @@ class BehaviorAgent(Agent):
             :param vehicle: car to follow
             :param distance: distance from vehicle
             :param debug: boolean for debugging
+            :param ego: EgoSnapshot of the agent for this step or None
             :return control: carla.VehicleControl
         """
 
@@ -343,16 +363,16 @@ class BehaviorAgent(Agent):
         if self.behavior.safety_time > ttc > 0.0:
             control = self._local_planner.run_step(
                 target_speed=min(positive(vehicle_speed - self.behavior.speed_decrease),
-                                 min(self.behavior.max_speed, self.speed_limit - self.behavior.speed_lim_dist)), debug=debug)
+                                 min(self.behavior.max_speed, self.speed_limit - self.behavior.speed_lim_dist)), debug=debug, ego=ego)
         # Actual safety distance area, try to follow the speed of the vehicle in front.
         elif 2 * self.behavior.safety_time > ttc >= self.behavior.safety_time:
             control = self._local_planner.run_step(
                 target_speed=min(max(self.min_speed, vehicle_speed),
-                                 min(self.behavior.max_speed, self.speed_limit - self.behavior.speed_lim_dist)), debug=debug)
+                                 min(self.behavior.max_speed, self.speed_limit - self.behavior.speed_lim_dist)), debug=debug, ego=ego)
         # Normal behavior.
         else:
             control = self._local_planner.run_step(
-                target_speed= min(self.behavior.max_speed, self.speed_limit - self.behavior.speed_lim_dist), debug=debug)
+                target_speed= min(self.behavior.max_speed, self.speed_limit - self.behavior.speed_lim_dist), debug=debug, ego=ego)
 
         return control
 
@@ -369,8 +389,9 @@ class BehaviorAgent(Agent):
         if self.behavior.overtake_counter > 0:
             self.behavior.overtake_counter -= 1
 
-        ego_vehicle_loc = self.vehicle.get_location()
-        ego_vehicle_wp = self._map.get_waypoint(ego_vehicle_loc)
+        ego = self.get_ego_snapshot()
+        ego_vehicle_loc = ego.location
+        ego_vehicle_wp = ego.waypoint
 
         # 1: Red lights and stops behavior
 
@@ -380,7 +401,7 @@ class BehaviorAgent(Agent):
         # 2.1: Pedestrian avoidancd behaviors
 
         walker_state, walker, w_distance = self.pedestrian_avoid_manager(
-            ego_vehicle_loc, ego_vehicle_wp)
+            ego_vehicle_loc, ego_vehicle_wp, ego)
 
         if walker_state:
             # Distance is computed from the center of the two cars,
@@ -395,7 +416,7 @@ class BehaviorAgent(Agent):
 
         # 2.2: Car following behaviors
         vehicle_state, vehicle, distance = self.collision_and_car_avoid_manager(
-            ego_vehicle_loc, ego_vehicle_wp)
+            ego_vehicle_loc, ego_vehicle_wp, ego)
 
         if vehicle_state:
             # Distance is computed from the center of the two cars,
@@ -408,20 +429,20 @@ class BehaviorAgent(Agent):
             if distance < self.behavior.braking_distance:
                 return self.emergency_stop()
             else:
-                control = self.car_following_manager(vehicle, distance)
+                control = self.car_following_manager(vehicle, distance, ego=ego)
 
         # 4: Intersection behavior
 
         # Checking if there's a junction nearby to slow down
         elif self.incoming_waypoint.is_junction and (self.incoming_direction == RoadOption.LEFT or self.incoming_direction == RoadOption.RIGHT):
             control = self._local_planner.run_step(
-                target_speed=min(self.behavior.max_speed, self.speed_limit - 5), debug=debug)
+                target_speed=min(self.behavior.max_speed, self.speed_limit - 5), debug=debug, ego=ego)
 
         # 5: Normal behavior
 
         # Calculate controller based on no turn, traffic light or vehicle in front
         else:
             control = self._local_planner.run_step(
-                target_speed= min(self.behavior.max_speed, self.speed_limit - self.behavior.speed_lim_dist), debug=debug)
+                target_speed= min(self.behavior.max_speed, self.speed_limit - self.behavior.speed_lim_dist), debug=debug, ego=ego)
 
         return control
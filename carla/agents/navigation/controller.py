@@ -5,7 +5,6 @@
 
 """ This module contains PID controllers to perform lateral and longitudinal control. """
 
-from collections import deque
 import math
 import numpy as np
 import carla
@@ -51,7 +50,7 @@ class VehiclePIDController():
         self._lon_controller = PIDLongitudinalController(self._vehicle, **args_longitudinal)
         self._lat_controller = PIDLateralController(self._vehicle, offset, **args_lateral)
 
-    def run_step(self, target_speed, waypoint):
+    def run_step(self, target_speed, waypoint, ego=None):
         """
         Execute one step of control invoking both lateral and longitudinal
         PID controllers to reach a target waypoint
@@ -59,11 +58,13 @@ class VehiclePIDController():
 
             :param target_speed: desired vehicle speed
             :param waypoint: target location encoded as a waypoint
+            :param ego: EgoSnapshot of the vehicle for this step, if None the
+                state is queried from the vehicle
             :return: distance (in meters) to the waypoint
         """
 
-        acceleration = self._lon_controller.run_step(target_speed)
-        current_steering = self._lat_controller.run_step(waypoint)
+        acceleration = self._lon_controller.run_step(target_speed, ego=ego)
+        current_steering = self._lat_controller.run_step(waypoint, ego=ego)
         control = carla.VehicleControl()
         if acceleration >= 0.0:
             control.throttle = min(acceleration, self.max_throt)
@@ -113,17 +114,19 @@ class PIDLongitudinalController():
         self._k_d = K_D
         self._k_i = K_I
         self._dt = dt
-        self._error_buffer = deque(maxlen=10)
+        self._error_buffer = ErrorHistory(10)
 
-    def run_step(self, target_speed, debug=False):
+    def run_step(self, target_speed, debug=False, ego=None):
         """
         Execute one step of longitudinal control to reach a given target speed.
 
             :param target_speed: target speed in Km/h
             :param debug: boolean for debugging
+            :param ego: EgoSnapshot of the vehicle for this step, if None the
+                speed is queried from the vehicle
             :return: throttle control
         """
-        current_speed = get_speed(self._vehicle)
+        current_speed = ego.speed if ego is not None else get_speed(self._vehicle)
 
         if debug:
             print('Current speed = {}'.format(current_speed))
@@ -143,13 +146,13 @@ class PIDLongitudinalController():
         self._error_buffer.append(error)
 
         if len(self._error_buffer) >= 2:
-            _de = (self._error_buffer[-1] - self._error_buffer[-2]) / self._dt
-            _ie = sum(self._error_buffer) * self._dt
+            _de = (error - self._error_buffer.previous) / self._dt
+            _ie = self._error_buffer.total * self._dt
         else:
             _de = 0.0
             _ie = 0.0
 
-        return np.clip((self._k_p * error) + (self._k_d * _de) + (self._k_i * _ie), -1.0, 1.0)
+        return _clip((self._k_p * error) + (self._k_d * _de) + (self._k_i * _ie), -1.0, 1.0)
 
 class PIDLateralController():
     """
@@ -174,19 +177,22 @@ class PIDLateralController():
         self._k_i = K_I
         self._dt = dt
         self._offset = offset
-        self._e_buffer = deque(maxlen=10)
+        self._e_buffer = ErrorHistory(10)
 
-    def run_step(self, waypoint):
+    def run_step(self, waypoint, ego=None):
         """
         Execute one step of lateral control to steer
         the vehicle towards a certain waypoin.
 
             :param waypoint: target waypoint
+            :param ego: EgoSnapshot of the vehicle for this step, if None the
+                transform is queried from the vehicle
             :return: steering control in the range [-1, 1] where:
             -1 maximum steering to left
             +1 maximum steering to right
         """
-        return self._pid_control(waypoint, self._vehicle.get_transform())
+        vehicle_transform = ego.transform if ego is not None else self._vehicle.get_transform()
+        return self._pid_control(waypoint, vehicle_transform)
 
     def _pid_control(self, waypoint, vehicle_transform):
         """
@@ -199,34 +205,236 @@ class PIDLateralController():
         # Get the ego's location and forward vector
         ego_loc = vehicle_transform.location
         v_vec = vehicle_transform.get_forward_vector()
-        v_vec = np.array([v_vec.x, v_vec.y, 0.0])
 
         # Get the vector vehicle-target_wp
         if self._offset != 0:
             # Displace the wp to the side
             w_tran = waypoint.transform
             r_vec = w_tran.get_right_vector()
-            w_loc = w_tran.location + carla.Location(x=self._offset*r_vec.x,
-                                                         y=self._offset*r_vec.y)
+            w_x = w_tran.location.x + self._offset * r_vec.x - ego_loc.x
+            w_y = w_tran.location.y + self._offset * r_vec.y - ego_loc.y
         else:
             w_loc = waypoint.transform.location
+            w_x = w_loc.x - ego_loc.x
+            w_y = w_loc.y - ego_loc.y
 
-        w_vec = np.array([w_loc.x - ego_loc.x,
-                          w_loc.y - ego_loc.y,
-                          0.0])
-
-        _dot = math.acos(np.clip(np.dot(w_vec, v_vec) /
-                                 (np.linalg.norm(w_vec) * np.linalg.norm(v_vec)), -1.0, 1.0))
-        _cross = np.cross(v_vec, w_vec)
-        if _cross[2] < 0:
+        # Signed angle between both vectors on the ground plane
+        norm = math.hypot(w_x, w_y) * math.hypot(v_vec.x, v_vec.y)
+        if norm > 0.0:
+            _dot = math.acos(_clip((w_x * v_vec.x + w_y * v_vec.y) / norm, -1.0, 1.0))
+        else:
+            _dot = float('nan')
+        if v_vec.x * w_y - v_vec.y * w_x < 0:
             _dot *= -1.0
 
         self._e_buffer.append(_dot)
         if len(self._e_buffer) >= 2:
-            _de = (self._e_buffer[-1] - self._e_buffer[-2]) / self._dt
-            _ie = sum(self._e_buffer) * self._dt
+            _de = (_dot - self._e_buffer.previous) / self._dt
+            _ie = self._e_buffer.total * self._dt
         else:
             _de = 0.0
             _ie = 0.0
 
-        return np.clip((self._k_p * _dot) + (self._k_d * _de) + (self._k_i * _ie), -1.0, 1.0)
+        return _clip((self._k_p * _dot) + (self._k_d * _de) + (self._k_i * _ie), -1.0, 1.0)
+
+
+class ErrorHistory():
+    """
+    ErrorHistory keeps the last errors of a PID controller in a ring buffer
+    together with their running sum, so the integral term is not summed again
+    at every step.
+    """
+
+    def __init__(self, size):
+        """
+        Constructor method.
+
+            :param size: number of errors kept
+        """
+        self._values = [0.0] * size
+        self._size = size
+        self._count = 0
+        self._position = -1
+        self.previous = 0.0
+        self.total = 0.0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, error):
+        """
+        Adds the newest error, dropping the oldest one if the history is full.
+
+            :param error: error of the current step
+        """
+        if self._count:
+            self.previous = self._values[self._position]
+        self._position = (self._position + 1) % self._size
+        if self._count == self._size:
+            self.total -= self._values[self._position]
+        else:
+            self._count += 1
+        self._values[self._position] = error
+        self.total += error
+        # Sum again once per lap to stop rounding errors from adding up
+        if self._position == self._size - 1 or not math.isfinite(self.total):
+            self.total = sum(self._values[self._position + 1:self._count] + self._values[:self._position + 1])
+
+
+def _clip(value, low, high):
+    """
+    Clamps value into [low, high], propagating NaN like numpy.clip.
+    """
+    if value < low:
+        return low
+    if value > high:
+        return high
+    return value
+
+
+class FleetPIDController():
+    """
+    FleetPIDController applies the control law of VehiclePIDController to a group of
+    vehicles at once: their states are read from a single world snapshot, the lateral and
+    longitudinal PID controllers of all of them run as array operations and the resulting
+    controls are sent in a single batch.
+    """
+
+
+    def __init__(self, client, vehicles, args_lateral, args_longitudinal, offset=0, max_throttle=0.75,
+                 max_brake=0.3, max_steering=0.8):
+        """
+        Constructor method.
+
+        :param client: carla.Client of the world the vehicles are in, used to send the controls
+        :param vehicles: list of actors to control, may be empty
+        :param args_lateral: dictionary of arguments to set the lateral PID controllers
+        (see VehiclePIDController)
+        :param args_longitudinal: dictionary of arguments to set the longitudinal PID controllers
+        (see VehiclePIDController)
+        :param offset: lateral displacement from the center line (see VehiclePIDController)
+        """
+        self.max_brake = max_brake
+        self.max_throt = max_throttle
+        self.max_steer = max_steering
+
+        self._client = client
+        self._vehicles = list(vehicles)
+        self._world = client.get_world()
+        self._offset = offset
+        self._lon_k = _pid_gains(**args_longitudinal)
+        self._lat_k = _pid_gains(**args_lateral)
+        self.past_steering = np.array([vehicle.get_control().steer for vehicle in self._vehicles])
+
+        # last 10 errors of every vehicle, column _position holds the newest one
+        self._lon_errors = np.zeros((len(self._vehicles), 10))
+        self._lat_errors = np.zeros((len(self._vehicles), 10))
+        self._position = -1
+        self._count = 0
+
+    def run_step(self, target_speeds, waypoints, apply=True):
+        """
+        Execute one step of control for every vehicle of the fleet.
+
+            :param target_speeds: desired speed of every vehicle in Km/h (or one for all)
+            :param waypoints: target waypoint of every vehicle
+            :param apply: whether to send the controls to the simulator
+            :return: list of carla.VehicleControl, one per vehicle
+        """
+        ego_x, ego_y, yaw, pitch, speed = self._vehicle_states()
+        target_x, target_y = self._target_locations(waypoints)
+
+        self._position = (self._position + 1) % 10
+        self._count = min(self._count + 1, 10)
+        acceleration = self._pid_step(self._lon_errors, np.broadcast_to(target_speeds, speed.shape) - speed,
+                                      self._lon_k)
+
+        # Angle between the heading of the vehicle and the direction to the target
+        v_x, v_y = np.cos(pitch) * np.cos(yaw), np.cos(pitch) * np.sin(yaw)
+        w_x, w_y = target_x - ego_x, target_y - ego_y
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cosine = (w_x * v_x + w_y * v_y) / (np.hypot(w_x, w_y) * np.hypot(v_x, v_y))
+        heading_error = np.arccos(np.clip(cosine, -1.0, 1.0))
+        heading_error = np.where(v_x * w_y - v_y * w_x < 0, -heading_error, heading_error)
+        current_steering = self._pid_step(self._lat_errors, heading_error, self._lat_k)
+
+        throttle = np.where(acceleration >= 0.0, np.minimum(acceleration, self.max_throt), 0.0)
+        brake = np.where(acceleration >= 0.0, 0.0, np.minimum(np.abs(acceleration), self.max_brake))
+
+        # Steering regulation: changes cannot happen abruptly, can't steer too much.
+        current_steering = np.where(current_steering > self.past_steering + 0.1, self.past_steering + 0.1,
+                                    np.where(current_steering < self.past_steering - 0.1,
+                                             self.past_steering - 0.1, current_steering))
+        steering = np.where(current_steering >= 0, np.minimum(self.max_steer, current_steering),
+                            np.fmax(-self.max_steer, current_steering))
+        self.past_steering = steering
+
+        controls = [carla.VehicleControl(throttle=float(t), steer=float(s), brake=float(b),
+                                         hand_brake=False, manual_gear_shift=False)
+                    for t, s, b in zip(throttle, steering, brake)]
+        if apply:
+            self._client.apply_batch([carla.command.ApplyVehicleControl(vehicle.id, control)
+                                      for vehicle, control in zip(self._vehicles, controls)])
+        return controls
+
+    def _vehicle_states(self):
+        """
+        Reads location, heading and speed of every vehicle from the current world snapshot.
+
+            :return: arrays x, y, yaw (radians), pitch (radians), speed (Km/h)
+        """
+        snapshot = self._world.get_snapshot()
+        states = np.empty((len(self._vehicles), 7))
+        for i, vehicle in enumerate(self._vehicles):
+            actor = snapshot.find(vehicle.id)
+            if actor is None:
+                raise RuntimeError('vehicle {} is not in the world snapshot'.format(vehicle.id))
+            transform, velocity = actor.get_transform(), actor.get_velocity()
+            states[i] = (transform.location.x, transform.location.y, transform.rotation.yaw,
+                         transform.rotation.pitch, velocity.x, velocity.y, velocity.z)
+        speed = 3.6 * np.sqrt(states[:, 4] ** 2 + states[:, 5] ** 2 + states[:, 6] ** 2)
+        return states[:, 0], states[:, 1], np.radians(states[:, 2]), np.radians(states[:, 3]), speed
+
+    def _target_locations(self, waypoints):
+        """
+        Target location of every vehicle, displaced by the offset to the right of the waypoint.
+
+            :return: arrays x, y
+        """
+        targets = np.array([(w.transform.location.x, w.transform.location.y, w.transform.rotation.yaw,
+                             w.transform.rotation.pitch, w.transform.rotation.roll) for w in waypoints],
+                           dtype=float).reshape(-1, 5)
+        target_x, target_y = targets[:, 0], targets[:, 1]
+        if self._offset != 0:
+            yaw, pitch, roll = np.radians(targets[:, 2]), np.radians(targets[:, 3]), np.radians(targets[:, 4])
+            # carla.Transform.get_right_vector
+            r_x = np.cos(yaw) * np.sin(pitch) * np.sin(roll) - np.sin(yaw) * np.cos(roll)
+            r_y = np.sin(yaw) * np.sin(pitch) * np.sin(roll) + np.cos(yaw) * np.cos(roll)
+            target_x, target_y = target_x + self._offset * r_x, target_y + self._offset * r_y
+        return target_x, target_y
+
+    def _pid_step(self, errors, error, gains):
+        """
+        Stores the new error of every vehicle and evaluates the PID equations.
+
+            :param errors: error history of the fleet
+            :param error: array with the current error of every vehicle
+            :param gains: (K_P, K_D, K_I, dt)
+            :return: array with the control value of every vehicle in the range [-1, 1]
+        """
+        k_p, k_d, k_i, dt = gains
+        errors[:, self._position] = error
+        if self._count >= 2:
+            _de = (error - errors[:, self._position - 1]) / dt
+            _ie = errors.sum(axis=1) * dt
+        else:
+            _de = 0.0
+            _ie = 0.0
+        return np.clip((k_p * error) + (k_d * _de) + (k_i * _ie), -1.0, 1.0)
+
+
+def _pid_gains(K_P=1.0, K_D=0.0, K_I=0.0, dt=0.03):
+    """
+    PID arguments in the order used by FleetPIDController.
+    """
+    return K_P, K_D, K_I, dt
@@ -9,14 +9,67 @@ This module provides GlobalRoutePlanner implementation.
 """
 
 import math
+from collections import OrderedDict
+
 import numpy as np
-import networkx as nx
 
 import carla
+from agents.navigation.global_route_planner_cache import GlobalRoutePlannerCache, LazyWaypointList
 from agents.navigation.local_planner import RoadOption
+from agents.navigation.localization_index import LocalizationIndex
+from agents.navigation.route_graph import RouteGraph, HEURISTIC_EUCLIDEAN, HEURISTIC_LANDMARKS
 from agents.tools.misc import vector
 
 
+def _locations(waypoints):
+    """
+    Returns list of (x, y, z) of the waypoints, read from the records
+    of a LazyWaypointList so that no waypoint is materialized.
+    """
+    if isinstance(waypoints, LazyWaypointList):
+        return [record[4][:3] for record in waypoints.records]
+    return [(w.transform.location.x, w.transform.location.y, w.transform.location.z) for w in waypoints]
+
+
+def _lane_key(waypoint):
+    """ Returns (road_id, section_id, lane_id) of the waypoint """
+    return waypoint.road_id, waypoint.section_id, waypoint.lane_id
+
+
+class RouteMatrix(object):
+    """
+    Routes between every origin and every destination of a batch query,
+    see GlobalRoutePlanner.route_matrix. Costs are computed up front,
+    traces only when requested.
+
+        costs   -   numpy array [origin, destination] of route lengths
+                    (sum of graph edge lengths), inf if there is no route
+    """
+
+    def __init__(self, planner, origins, destinations, costs, routes):
+        self._planner = planner
+        self._origins = origins
+        self._destinations = destinations
+        self._routes = routes
+        self._traces = dict()
+        self.costs = costs
+
+    def route(self, i, j):
+        """ Returns the route from origins[i] to destinations[j] as list of node ids, None if there is no route """
+        return self._routes(i, j)
+
+    def trace(self, i, j):
+        """
+        Returns list of (carla.Waypoint, RoadOption) from origins[i] to destinations[j],
+        as GlobalRoutePlanner.trace_route does, or None if there is no route
+        """
+        if (i, j) not in self._traces:
+            route = self._routes(i, j)
+            self._traces[i, j] = None if route is None else self._planner._trace_nodes(
+                route, self._origins[i], self._destinations[j])
+        return self._traces[i, j]
+
+
 class GlobalRoutePlanner(object):
     """
     This class provides a very high level route plan.
@@ -24,31 +77,259 @@ class GlobalRoutePlanner(object):
     A GlobalRoutePlannerDAO object.
     """
 
-    def __init__(self, dao):
+    def __init__(self, dao, cache_dir=None, route_cache_size=128, landmarks=0):
         """
         Constructor
+
+            :param dao: GlobalRoutePlannerDAO object
+            :param cache_dir: directory of the persistent graph cache,
+                None disables the cache
+            :param route_cache_size: number of routes and traces kept in
+                the in-memory LRU cache, 0 disables the cache
+            :param landmarks: number of ALT landmarks. With landmarks the
+                route search returns shortest routes expanding far fewer
+                nodes; 0 keeps the straight line distance heuristic
         """
         self._dao = dao
+        self._cache = GlobalRoutePlannerCache(cache_dir) if cache_dir is not None else None
         self._topology = None
         self._graph = None
         self._id_map = None
         self._road_id_to_edge = None
+        self._localization_index = None
+        self._edge_vectors = None
+        self._edge_point_arrays = dict()
         self._intersection_end_node = -1
         self._previous_decision = RoadOption.VOID
+        self._route_cache = OrderedDict()
+        self._route_cache_size = route_cache_size
+        self._landmark_count = landmarks
+        self._route_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+        self._next_node_id = 0
+        self._loose_end_count = 0
 
     def setup(self):
         """
         Performs initial server data lookup for detailed topology
         and builds graph representation of the world map.
+        If a cache directory is set, the graph is loaded from the cache
+        when the map did not change since it was stored.
         """
-        self._topology = self._dao.get_topology()
-        self._graph, self._id_map, self._road_id_to_edge = self._build_graph()
-        self._find_loose_ends()
-        self._lane_change_link()
+        self._localization_index = None
+        loaded = self._cache is not None and self._load_cache()
+        if not loaded:
+            self._topology = self._dao.get_topology()
+            self._graph, self._id_map, self._road_id_to_edge = self._build_graph()
+            self._find_loose_ends()
+            self._lane_change_link()
+        landmarks_built = self._update_landmarks()
+        if self._cache is not None and (not loaded or landmarks_built):
+            self._cache.store(
+                self._dao, self._topology, [(n, d['vertex']) for n, d in self._graph.nodes.items()],
+                list(self._graph.edges.data()), self._id_map, self._road_id_to_edge,
+                self._graph.landmark_state())
+        self._graph_changed()
+
+    def _update_landmarks(self):
+        """
+        Builds the ALT landmarks if they are enabled and missing,
+        e.g. after the graph changed.
+
+            :return: True if the landmarks were built
+        """
+        if self._landmark_count <= 0 or self._graph.has_landmarks():
+            return False
+        self._graph.build_landmarks(self._landmark_count)
+        return True
+
+    def _graph_changed(self, removed_edges=None):
+        """
+        This method must be called whenever the graph is modified,
+        it drops everything derived from the previous graph.
+        removed_edges   :   set of (n1, n2) edges, if the change only removed
+                            these edges; then only routes using them are dropped.
+                            None if anything was added, as a new edge may
+                            shorten any route.
+        """
+        self._edge_vectors = None
+        self._edge_point_arrays = dict()
+        if removed_edges is None:
+            self._route_cache_stats['invalidations'] += len(self._route_cache)
+            self._route_cache.clear()
+            return
+        for key, value in list(self._route_cache.items()):
+            # ('route', start, end) holds the route, ('trace', start, end, ...) holds (route, trace)
+            route = value if key[0] == 'route' else value[0]
+            if key[1] in removed_edges or key[2] in removed_edges or \
+                    any(edge in removed_edges for edge in zip(route, route[1:])):
+                del self._route_cache[key]
+                self._route_cache_stats['invalidations'] += 1
+
+    def add_segments(self, segments):
+        """
+        Adds road segments to the graph without rebuilding it, e.g. after
+        the map was edited. Loose ends and lane change links are updated
+        for the roads of the new segments.
+
+            :param segments: list of (entry, exit) waypoint pairs,
+                as returned by carla.Map.get_topology
+        """
+        topology = self._dao.sample_segments(segments)
+        for segment in topology:
+            edge = self._lane_edge(_lane_key(segment['entry']))
+            if edge is not None and edge[1] < 0:
+                # The lane was missing so far, a loose end stands in for it
+                self._remove_loose_end(_lane_key(segment['entry']))
+            self._topology.append(segment)
+            self._add_segment_edge(self._graph, self._id_map, self._road_id_to_edge, segment)
+        self._find_loose_ends(topology)
+        self._localization_index = None
+        self._relink_lane_changes({segment['entry'].road_id for segment in topology})
+        self._graph_changed()
+
+    def remove_segments(self, lanes):
+        """
+        Removes road segments from the graph without rebuilding it.
+        Lane change links into and out of the removed lanes are removed,
+        segments leading into them get loose ends, as setup() would do.
+
+            :param lanes: list of (road_id, section_id, lane_id) of the segments to remove
+        """
+        lanes = set(lanes)
+        removed = [segment for segment in self._topology if _lane_key(segment['entry']) in lanes]
+        if not removed:
+            return
+        self._topology = [segment for segment in self._topology if _lane_key(segment['entry']) not in lanes]
+        removed_edges = set()
+        nodes = set()
+
+        for segment in removed:
+            n1, n2 = self._id_map[segment['entryxyz']], self._id_map[segment['exitxyz']]
+            nodes.update((n1, n2))
+            for edge in [(n1, n) for n in self._graph.successors(n1)] + [(n, n1) for n in self._graph.predecessors(n1)]:
+                if self._graph.edges[edge]['type'] in (RoadOption.CHANGELANELEFT, RoadOption.CHANGELANERIGHT):
+                    self._graph.remove_edge(*edge)
+                    removed_edges.add(edge)
+            if (n1, n2) in self._graph.edges:
+                self._graph.remove_edge(n1, n2)
+                removed_edges.add((n1, n2))
+            key = _lane_key(segment['entry'])
+            if self._lane_edge(key) == (n1, n2):
+                del self._road_id_to_edge[key[0]][key[1]][key[2]]
+
+        # Loose ends used only by the removed segments go away with them
+        exits = {_lane_key(segment['exit']) for segment in self._topology}
+        for segment in removed:
+            key = _lane_key(segment['exit'])
+            edge = self._lane_edge(key)
+            if key not in exits and edge is not None and edge[1] < 0:
+                removed_edges.add(edge)
+                self._remove_loose_end(key)
+        self._find_loose_ends([segment for segment in self._topology if _lane_key(segment['exit']) in lanes])
+
+        for node in nodes:
+            if node in self._graph.nodes and not self._graph.successors(node) and not self._graph.predecessors(node):
+                del self._id_map[self._graph.nodes[node]['vertex']]
+                self._graph.remove_node(node)
+
+        self._localization_index = None
+        added, vanished = self._relink_lane_changes({segment['entry'].road_id for segment in removed})
+        self._graph_changed(None if added else removed_edges | vanished)
+
+    def _lane_edge(self, key):
+        """ Returns the edge of the lane (road_id, section_id, lane_id) or None """
+        road_id, section_id, lane_id = key
+        return self._road_id_to_edge.get(road_id, {}).get(section_id, {}).get(lane_id)
+
+    def _remove_loose_end(self, key):
+        """ Removes the loose end edge standing in for the lane (road_id, section_id, lane_id) """
+        road_id, section_id, lane_id = key
+        _, n2 = self._road_id_to_edge[road_id][section_id].pop(lane_id)
+        if n2 in self._graph.nodes:
+            self._graph.remove_node(n2)
+
+    def _relink_lane_changes(self, road_ids):
+        """
+        Recomputes lane change links out of all segments of the roads.
+
+            :return: tuple (added, vanished) of the sets of links that did not
+                exist before and of those that do not exist any more
+        """
+        segments = [segment for segment in self._topology if segment['entry'].road_id in road_ids]
+
+        def links():
+            found = set()
+            for segment in segments:
+                n1 = self._id_map[segment['entryxyz']]
+                for n2 in self._graph.successors(n1):
+                    if self._graph.edges[n1, n2]['type'] in (RoadOption.CHANGELANELEFT, RoadOption.CHANGELANERIGHT):
+                        found.add((n1, n2))
+            return found
+
+        before = links()
+        for edge in before:
+            self._graph.remove_edge(*edge)
+        self._lane_change_link(segments)
+        after = links()
+        return after - before, before - after
+
+    def _cached(self, key, compute):
+        """
+        Returns the value of key from the LRU route cache,
+        computing and storing it on a miss.
+        """
+        if key in self._route_cache:
+            self._route_cache.move_to_end(key)
+            self._route_cache_stats['hits'] += 1
+            return self._route_cache[key]
+        self._route_cache_stats['misses'] += 1
+        value = compute()
+        if self._route_cache_size > 0:
+            self._route_cache[key] = value
+            if len(self._route_cache) > self._route_cache_size:
+                self._route_cache.popitem(last=False)
+                self._route_cache_stats['evictions'] += 1
+        return value
+
+    def route_cache_info(self):
+        """
+        Returns dictionary with hits, misses and evictions of
+        the route cache and its current and maximum size.
+        """
+        info = dict(self._route_cache_stats)
+        info['size'] = len(self._route_cache)
+        info['max_size'] = self._route_cache_size
+        return info
+
+    def _load_cache(self):
+        """
+        Restores topology and graph from the cache.
+
+            :return: True if the cache held a valid entry for the current map
+        """
+        state = self._cache.load(self._dao)
+        if state is None:
+            return False
+        graph = RouteGraph()
+        for node, vertex in state['nodes']:
+            graph.add_node(node, vertex=vertex)
+        for n1, n2, attributes in state['edges']:
+            graph.add_edge(n1, n2, **attributes)
+        self._topology = state['topology']
+        self._graph = graph
+        self._id_map = state['id_map']
+        self._road_id_to_edge = state['road_id_to_edge']
+        if self._landmark_count > 0 and state['landmarks'] is not None and \
+                len(state['landmarks']['landmarks']) <= self._landmark_count:
+            graph.set_landmark_state(state['landmarks'])
+        self._next_node_id = max(self._id_map.values()) + 1 if self._id_map else 0
+        self._loose_end_count = -min([0] + [edge[1] for sections in self._road_id_to_edge.values()
+                                            for lanes in sections.values() for edge in lanes.values()])
+        return True
 
     def _build_graph(self):
         """
-        This function builds a networkx graph representation of topology.
+        This function builds a RouteGraph representation of topology.
         The topology is read from self._topology.
         graph node properties:
             vertex   -   (x,y,z) position in world map
@@ -58,74 +339,85 @@ class GlobalRoutePlanner(object):
             net_vector      -   unit vector of the chord from entry to exit
             intersection    -   boolean indicating if the edge belongs to an
                                 intersection
-        return      :   graph -> networkx graph representing the world map,
+        return      :   graph -> RouteGraph representing the world map,
                         id_map-> mapping from (x,y,z) to node id
                         road_id_to_edge-> map from road id to edge in the graph
         """
-        graph = nx.DiGraph()
+        graph = RouteGraph()
         id_map = dict()  # Map with structure {(x,y,z): id, ... }
         road_id_to_edge = dict()  # Map with structure {road_id: {lane_id: edge, ... }, ... }
+        self._next_node_id = 0
 
         for segment in self._topology:
-
-            entry_xyz, exit_xyz = segment['entryxyz'], segment['exitxyz']
-            path = segment['path']
-            entry_wp, exit_wp = segment['entry'], segment['exit']
-            intersection = entry_wp.is_junction
-            road_id, section_id, lane_id = entry_wp.road_id, entry_wp.section_id, entry_wp.lane_id
-
-            for vertex in entry_xyz, exit_xyz:
-                # Adding unique nodes and populating id_map
-                if vertex not in id_map:
-                    new_id = len(id_map)
-                    id_map[vertex] = new_id
-                    graph.add_node(new_id, vertex=vertex)
-            n1 = id_map[entry_xyz]
-            n2 = id_map[exit_xyz]
-            if road_id not in road_id_to_edge:
-                road_id_to_edge[road_id] = dict()
-            if section_id not in road_id_to_edge[road_id]:
-                road_id_to_edge[road_id][section_id] = dict()
-            road_id_to_edge[road_id][section_id][lane_id] = (n1, n2)
-
-            entry_carla_vector = entry_wp.transform.rotation.get_forward_vector()
-            exit_carla_vector = exit_wp.transform.rotation.get_forward_vector()
-
-            # Adding edge with attributes
-            graph.add_edge(
-                n1, n2,
-                length=len(path) + 1, path=path,
-                entry_waypoint=entry_wp, exit_waypoint=exit_wp,
-                entry_vector=np.array(
-                    [entry_carla_vector.x, entry_carla_vector.y, entry_carla_vector.z]),
-                exit_vector=np.array(
-                    [exit_carla_vector.x, exit_carla_vector.y, exit_carla_vector.z]),
-                net_vector=vector(entry_wp.transform.location, exit_wp.transform.location),
-                intersection=intersection, type=RoadOption.LANEFOLLOW)
+            self._add_segment_edge(graph, id_map, road_id_to_edge, segment)
 
         return graph, id_map, road_id_to_edge
 
-    def _find_loose_ends(self):
+    def _add_segment_edge(self, graph, id_map, road_id_to_edge, segment):
+        """
+        This function adds the nodes and the lane following edge of one
+        topology segment to graph, id_map and road_id_to_edge.
+        """
+        entry_xyz, exit_xyz = segment['entryxyz'], segment['exitxyz']
+        path = segment['path']
+        entry_wp, exit_wp = segment['entry'], segment['exit']
+        intersection = entry_wp.is_junction
+        road_id, section_id, lane_id = entry_wp.road_id, entry_wp.section_id, entry_wp.lane_id
+
+        for vertex in entry_xyz, exit_xyz:
+            # Adding unique nodes and populating id_map
+            if vertex not in id_map:
+                new_id = self._next_node_id
+                self._next_node_id += 1
+                id_map[vertex] = new_id
+                graph.add_node(new_id, vertex=vertex)
+        n1 = id_map[entry_xyz]
+        n2 = id_map[exit_xyz]
+        if road_id not in road_id_to_edge:
+            road_id_to_edge[road_id] = dict()
+        if section_id not in road_id_to_edge[road_id]:
+            road_id_to_edge[road_id][section_id] = dict()
+        road_id_to_edge[road_id][section_id][lane_id] = (n1, n2)
+
+        entry_carla_vector = entry_wp.transform.rotation.get_forward_vector()
+        exit_carla_vector = exit_wp.transform.rotation.get_forward_vector()
+
+        # Adding edge with attributes
+        graph.add_edge(
+            n1, n2,
+            length=len(path) + 1, path=path,
+            entry_waypoint=entry_wp, exit_waypoint=exit_wp,
+            entry_vector=np.array(
+                [entry_carla_vector.x, entry_carla_vector.y, entry_carla_vector.z]),
+            exit_vector=np.array(
+                [exit_carla_vector.x, exit_carla_vector.y, exit_carla_vector.z]),
+            net_vector=vector(entry_wp.transform.location, exit_wp.transform.location),
+            intersection=intersection, type=RoadOption.LANEFOLLOW)
+
+    def _find_loose_ends(self, segments=None):
         """
         This method finds road segments that have an unconnected end, and
         adds them to the internal graph representation
+        segments    :   segments to check, all of the topology by default
         """
-        count_loose_ends = 0
+        if segments is None:
+            self._loose_end_count = 0
+            segments = self._topology
         hop_resolution = self._dao.get_resolution()
-        for segment in self._topology:
+        for segment in segments:
             end_wp = segment['exit']
             exit_xyz = segment['exitxyz']
             road_id, section_id, lane_id = end_wp.road_id, end_wp.section_id, end_wp.lane_id
             if road_id in self._road_id_to_edge and section_id in self._road_id_to_edge[road_id] and lane_id in self._road_id_to_edge[road_id][section_id]:
                 pass
             else:
-                count_loose_ends += 1
+                self._loose_end_count += 1
                 if road_id not in self._road_id_to_edge:
                     self._road_id_to_edge[road_id] = dict()
                 if section_id not in self._road_id_to_edge[road_id]:
                     self._road_id_to_edge[road_id][section_id] = dict()
                 n1 = self._id_map[exit_xyz]
-                n2 = -1*count_loose_ends
+                n2 = -1*self._loose_end_count
                 self._road_id_to_edge[road_id][section_id][lane_id] = (n1, n2)
                 next_wp = end_wp.next(hop_resolution)
                 path = []
@@ -146,10 +438,19 @@ class GlobalRoutePlanner(object):
 
     def _localize(self, location):
         """
-        This function finds the road segment closest to given location
+        This function finds the road segment closest to given location.
+        The local index answers most queries, the server is asked only
+        when the index cannot tell the lane reliably.
         location        :   carla.Location to be localized in the graph
         return          :   pair node ids representing an edge in the graph
         """
+        if self._localization_index is None:
+            self._localization_index = self._build_localization_index()
+        key = self._localization_index.query(location.x, location.y, location.z)
+        if key is not None:
+            road_id, section_id, lane_id = key
+            return self._road_id_to_edge[road_id][section_id][lane_id]
+
         waypoint = self._dao.get_waypoint(location)
         edge = None
         try:
@@ -164,13 +465,33 @@ class GlobalRoutePlanner(object):
                 waypoint.transform.location.y)
         return edge
 
-    def _lane_change_link(self):
+    def _build_localization_index(self):
+        """
+        This function builds the localization index over the sampled
+        waypoints of all lane following edges of the graph.
+        """
+        index = LocalizationIndex()
+        for _, _, edge in self._graph.edges.data():
+            if edge['type'] != RoadOption.LANEFOLLOW:
+                continue
+            entry_wp, exit_wp = edge['entry_waypoint'], edge['exit_waypoint']
+            key = (entry_wp.road_id, entry_wp.section_id, entry_wp.lane_id)
+            try:
+                self._road_id_to_edge[key[0]][key[1]][key[2]]
+            except KeyError:
+                continue
+            points = _locations([entry_wp]) + _locations(edge['path']) + _locations([exit_wp])
+            index.add_lane(points, key, entry_wp.lane_width)
+        return index
+
+    def _lane_change_link(self, segments=None):
         """
         This method places zero cost links in the topology graph
         representing availability of lane changes.
+        segments    :   segments to link, all of the topology by default
         """
 
-        for segment in self._topology:
+        for segment in self._topology if segments is None else segments:
             left_found, right_found = False, False
 
             for waypoint in segment['path']:
@@ -202,15 +523,6 @@ class GlobalRoutePlanner(object):
                 if left_found and right_found:
                     break
 
-    def _distance_heuristic(self, n1, n2):
-        """
-        Distance heuristic calculator for path searching
-        in self._graph
-        """
-        l1 = np.array(self._graph.nodes[n1]['vertex'])
-        l2 = np.array(self._graph.nodes[n2]['vertex'])
-        return np.linalg.norm(l1-l2)
-
     def _path_search(self, origin, destination):
         """
         This function finds the shortest path connecting origin and destination
@@ -222,19 +534,57 @@ class GlobalRoutePlanner(object):
         """
 
         start, end = self._localize(origin), self._localize(destination)
+        return list(self._cached(('route', start, end), lambda: self._edge_route(start, end)))
 
-        route = nx.astar_path(
-            self._graph, source=start[0], target=end[0],
-            heuristic=self._distance_heuristic, weight='length')
+    def _edge_route(self, start, end):
+        """
+        This function finds the shortest path from edge start to edge end
+        return      :   path as list of node ids
+        """
+        self._update_landmarks()
+        heuristic = HEURISTIC_LANDMARKS if self._landmark_count > 0 else HEURISTIC_EUCLIDEAN
+        route = self._graph.astar(start[0], end[0], heuristic)
         route.append(end[1])
         return route
 
+    def route_matrix(self, origins, destinations):
+        """
+        This function finds the routes between every origin and every destination.
+        Each location is localized once and one Dijkstra search per origin
+        serves all destinations.
+        origins         :   list of carla.Location of start positions
+        destinations    :   list of carla.Location of end positions
+        return          :   RouteMatrix
+        """
+
+        starts = [self._localize(origin) for origin in origins]
+        ends = [self._localize(destination) for destination in destinations]
+        trees = [self._graph.shortest_path_tree(start[0]) if start is not None else None for start in starts]
+
+        costs = np.full((len(origins), len(destinations)), np.inf)
+        for i, tree in enumerate(trees):
+            if tree is None:
+                continue
+            for j, end in enumerate(ends):
+                if end is not None:
+                    costs[i, j] = tree.distance(end[0]) + self._graph.edges[end]['length']
+
+        def routes(i, j):
+            if not np.isfinite(costs[i, j]):
+                return None
+            route = trees[i].path(ends[j][0])
+            route.append(ends[j][1])
+            return route
+
+        return RouteMatrix(self, origins, destinations, costs, routes)
+
     def _successive_last_intersection_edge(self, index, route):
         """
         This method returns the last successive intersection edge
         from a starting index on the route.
         This helps moving past tiny intersection edges to calculate
         proper turn decisions.
+        return      :   (last node, (node1, node2) of the last intersection edge)
         """
 
         last_intersection_edge = None
@@ -242,72 +592,123 @@ class GlobalRoutePlanner(object):
         for node1, node2 in [(route[i], route[i+1]) for i in range(index, len(route)-1)]:
             candidate_edge = self._graph.edges[node1, node2]
             if node1 == route[index]:
-                last_intersection_edge = candidate_edge
+                last_intersection_edge = (node1, node2)
             if candidate_edge['type'] == RoadOption.LANEFOLLOW and candidate_edge['intersection']:
-                last_intersection_edge = candidate_edge
+                last_intersection_edge = (node1, node2)
                 last_node = node2
             else:
                 break
 
         return last_node, last_intersection_edge
 
-    def _turn_decision(self, index, route, threshold=math.radians(35)):
+    def _edge_vector_arrays(self):
+        """
+        This method returns the exit and net vectors of all graph edges as
+        contiguous (edges x 3) arrays, rows of missing vectors are nan,
+        together with the map from (n1, n2) to row. Built once per graph.
         """
-        This method returns the turn decision (RoadOption) for pair of edges
-        around current index of route list
+        if self._edge_vectors is None:
+            rows = dict()
+            exit_vectors = np.full((len(self._graph.edges), 3), np.nan)
+            net_vectors = np.full((len(self._graph.edges), 3), np.nan)
+            for row, (n1, n2, edge) in enumerate(self._graph.edges.data()):
+                rows[n1, n2] = row
+                if edge.get('exit_vector') is not None:
+                    exit_vectors[row] = edge['exit_vector']
+                if edge.get('net_vector') is not None:
+                    net_vectors[row] = edge['net_vector']
+            self._edge_vectors = rows, exit_vectors, net_vectors
+        return self._edge_vectors
+
+    def _turn_geometry(self, route, threshold):
+        """
+        This method evaluates, in one vectorized pass, every turn of the route
+        that _turn_decisions may need: nodes where a lane following edge
+        enters an intersection.
+        return      :   dictionary {index: (last intersection node, decision, missing)},
+                        decision is a RoadOption or None if undecided; missing
+                        tells that a vector was missing and decision is the
+                        type of the tail edge
+        """
+        edges = self._graph.edges
+        rows, exit_vectors, net_vectors = self._edge_vector_arrays()
+        turns, current_rows, next_rows, owners, neighbor_rows = [], [], [], [], []
+        for index in range(1, len(route) - 1):
+            current_edge = edges[route[index-1], route[index]]
+            next_edge = edges[route[index], route[index+1]]
+            if current_edge['type'] == RoadOption.LANEFOLLOW and not current_edge['intersection'] and \
+                    next_edge['type'] == RoadOption.LANEFOLLOW and next_edge['intersection']:
+                last_node, tail_edge = self._successive_last_intersection_edge(index, route)
+                turns.append((index, last_node, tail_edge))
+                current_rows.append(rows[route[index-1], route[index]])
+                next_rows.append(rows[tail_edge])
+                for neighbor in self._graph.successors(route[index]):
+                    if neighbor != route[index+1] and edges[route[index], neighbor]['type'] == RoadOption.LANEFOLLOW:
+                        owners.append(len(turns) - 1)
+                        neighbor_rows.append(rows[route[index], neighbor])
+        if not turns:
+            return dict()
+
+        cv, nv = exit_vectors[current_rows], exit_vectors[next_rows]
+        next_cross = cv[:, 0] * nv[:, 1] - cv[:, 1] * nv[:, 0]
+        norms = np.sqrt(np.einsum('ij,ij->i', cv, cv)) * np.sqrt(np.einsum('ij,ij->i', nv, nv))
+        with np.errstate(invalid='ignore'):
+            deviation = np.arccos(np.clip(np.einsum('ij,ij->i', cv, nv) / norms, -1.0, 1.0))
+
+        # Cross products with the other lane following exits of the node,
+        # a node without them compares against 0
+        owners = np.array(owners, dtype=int)
+        sv, ov = net_vectors[np.array(neighbor_rows, dtype=int)], cv[owners]
+        crosses = ov[:, 0] * sv[:, 1] - ov[:, 1] * sv[:, 0]
+        cross_min, cross_max = np.full(len(turns), np.inf), np.full(len(turns), -np.inf)
+        np.minimum.at(cross_min, owners, crosses)
+        np.maximum.at(cross_max, owners, crosses)
+        alone = np.bincount(owners, minlength=len(turns)) == 0
+        cross_min[alone], cross_max[alone] = 0.0, 0.0
+
+        decisions = [RoadOption.STRAIGHT, RoadOption.LEFT, RoadOption.RIGHT, RoadOption.LEFT, RoadOption.RIGHT, None]
+        with np.errstate(invalid='ignore'):
+            choice = np.select(
+                [deviation < threshold, next_cross < cross_min, next_cross > cross_max,
+                 next_cross < 0, next_cross > 0], range(5), default=5)
+        missing = np.isnan(cv).any(axis=1) | np.isnan(nv).any(axis=1)
+
+        geometry = dict()
+        for k, (index, last_node, tail_edge) in enumerate(turns):
+            decision = edges[tail_edge]['type'] if missing[k] else decisions[choice[k]]
+            geometry[index] = (last_node, decision, bool(missing[k]))
+        return geometry
+
+    def _turn_decisions(self, route, threshold=math.radians(35)):
+        """
+        This method returns the turn decisions (RoadOption) for all pairs of
+        edges around each index of route list. The geometry comes from
+        _turn_geometry; only the decision state is carried node by node.
         """
 
-        decision = None
-        previous_node = route[index-1]
-        current_node = route[index]
-        next_node = route[index+1]
-        next_edge = self._graph.edges[current_node, next_node]
-        if index > 0:
-            if self._previous_decision != RoadOption.VOID and self._intersection_end_node > 0 and self._intersection_end_node != previous_node and next_edge['type'] == RoadOption.LANEFOLLOW and next_edge['intersection']:
-                decision = self._previous_decision
-            else:
-                self._intersection_end_node = -1
-                current_edge = self._graph.edges[previous_node, current_node]
-                calculate_turn = current_edge['type'] == RoadOption.LANEFOLLOW and not current_edge[
-                    'intersection'] and next_edge['type'] == RoadOption.LANEFOLLOW and next_edge['intersection']
-                if calculate_turn:
-                    last_node, tail_edge = self._successive_last_intersection_edge(index, route)
-                    self._intersection_end_node = last_node
-                    if tail_edge is not None:
-                        next_edge = tail_edge
-                    cv, nv = current_edge['exit_vector'], next_edge['exit_vector']
-                    if cv is None or nv is None:
-                        return next_edge['type']
-                    cross_list = []
-                    for neighbor in self._graph.successors(current_node):
-                        select_edge = self._graph.edges[current_node, neighbor]
-                        if select_edge['type'] == RoadOption.LANEFOLLOW:
-                            if neighbor != route[index+1]:
-                                sv = select_edge['net_vector']
-                                cross_list.append(np.cross(cv, sv)[2])
-                    next_cross = np.cross(cv, nv)[2]
-                    deviation = math.acos(np.clip(
-                        np.dot(cv, nv)/(np.linalg.norm(cv)*np.linalg.norm(nv)), -1.0, 1.0))
-                    if not cross_list:
-                        cross_list.append(0)
-                    if deviation < threshold:
-                        decision = RoadOption.STRAIGHT
-                    elif cross_list and next_cross < min(cross_list):
-                        decision = RoadOption.LEFT
-                    elif cross_list and next_cross > max(cross_list):
-                        decision = RoadOption.RIGHT
-                    elif next_cross < 0:
-                        decision = RoadOption.LEFT
-                    elif next_cross > 0:
-                        decision = RoadOption.RIGHT
+        edges = self._graph.edges
+        geometry = self._turn_geometry(route, threshold)
+        plan = []
+        for index in range(len(route) - 1):
+            next_edge = edges[route[index], route[index+1]]
+            if index > 0:
+                if self._previous_decision != RoadOption.VOID and self._intersection_end_node > 0 and self._intersection_end_node != route[index-1] and next_edge['type'] == RoadOption.LANEFOLLOW and next_edge['intersection']:
+                    decision = self._previous_decision
                 else:
-                    decision = next_edge['type']
-
-        else:
-            decision = next_edge['type']
-
-        self._previous_decision = decision
-        return decision
+                    self._intersection_end_node = -1
+                    if index in geometry:
+                        self._intersection_end_node, decision, missing = geometry[index]
+                        if missing:
+                            # Without vectors the edge type is used and not remembered
+                            plan.append(decision)
+                            continue
+                    else:
+                        decision = next_edge['type']
+            else:
+                decision = next_edge['type']
+            self._previous_decision = decision
+            plan.append(decision)
+        return plan
 
     def abstract_route_plan(self, origin, destination):
         """
@@ -321,25 +722,26 @@ class GlobalRoutePlanner(object):
         """
 
         route = self._path_search(origin, destination)
-        plan = []
+        return self._turn_decisions(route)
 
-        for i in range(len(route) - 1):
-            road_option = self._turn_decision(i, route)
-            plan.append(road_option)
-
-        return plan
-
-    def _find_closest_in_list(self, current_waypoint, waypoint_list):
-        min_distance = float('inf')
-        closest_index = -1
-        for i, waypoint in enumerate(waypoint_list):
-            distance = waypoint.transform.location.distance(
-                current_waypoint.transform.location)
-            if distance < min_distance:
-                min_distance = distance
-                closest_index = i
-
-        return closest_index
+    def _edge_points(self, edge):
+        """
+        This method returns the locations of entry, path and exit waypoints
+        of edge (n1, n2) as contiguous (n x 3) array, built once per edge.
+        """
+        points = self._edge_point_arrays.get(edge)
+        if points is None:
+            attributes = self._graph.edges[edge]
+            points = np.array(_locations([attributes['entry_waypoint']]) + _locations(attributes['path']) +
+                              _locations([attributes['exit_waypoint']]))
+            self._edge_point_arrays[edge] = points
+        return points
+
+    @staticmethod
+    def _closest_index(points, location):
+        """ Returns index of the first of points closest to carla.Location location """
+        delta = points - (location.x, location.y, location.z)
+        return int(np.argmin(np.einsum('ij,ij->i', delta, delta)))
 
     def trace_route(self, origin, destination):
         """
@@ -347,16 +749,33 @@ class GlobalRoutePlanner(object):
         from origin to destination
         """
 
+        start, end = self._localize(origin), self._localize(destination)
+
+        def trace():
+            route = list(self._cached(('route', start, end), lambda: self._edge_route(start, end)))
+            return route, self._trace_nodes(route, origin, destination)
+
+        # The waypoints of a trace depend on the exact positions, not only on the edges
+        key = ('trace', start, end, (origin.x, origin.y, origin.z), (destination.x, destination.y, destination.z))
+        return list(self._cached(key, trace)[1])
+
+    def _trace_nodes(self, route, origin, destination):
+        """
+        This method expands a route given as list of node ids into
+        list of (carla.Waypoint, RoadOption) from origin to destination
+        """
+
         route_trace = []
-        route = self._path_search(origin, destination)
+        self._previous_decision = RoadOption.VOID
+        self._intersection_end_node = -1
         current_waypoint = self._dao.get_waypoint(origin)
         destination_waypoint = self._dao.get_waypoint(destination)
         resolution = self._dao.get_resolution()
 
+        decisions = self._turn_decisions(route)
         for i in range(len(route) - 1):
-            road_option = self._turn_decision(i, route)
+            road_option = decisions[i]
             edge = self._graph.edges[route[i], route[i+1]]
-            path = []
 
             if edge['type'] != RoadOption.LANEFOLLOW and edge['type'] != RoadOption.VOID:
                 route_trace.append((current_waypoint, road_option))
@@ -364,7 +783,9 @@ class GlobalRoutePlanner(object):
                 n1, n2 = self._road_id_to_edge[exit_wp.road_id][exit_wp.section_id][exit_wp.lane_id]
                 next_edge = self._graph.edges[n1, n2]
                 if next_edge['path']:
-                    closest_index = self._find_closest_in_list(current_waypoint, next_edge['path'])
+                    # Rows 1..n-2 of the edge points are its path
+                    closest_index = self._closest_index(self._edge_points((n1, n2))[1:-1],
+                                                        current_waypoint.transform.location)
                     closest_index = min(len(next_edge['path'])-1, closest_index+5)
                     current_waypoint = next_edge['path'][closest_index]
                 else:
@@ -372,16 +793,26 @@ class GlobalRoutePlanner(object):
                 route_trace.append((current_waypoint, road_option))
 
             else:
-                path = path + [edge['entry_waypoint']] + edge['path'] + [edge['exit_waypoint']]
-                closest_index = self._find_closest_in_list(current_waypoint, path)
-                for waypoint in path[closest_index:]:
-                    current_waypoint = waypoint
+                points = self._edge_points((route[i], route[i+1]))
+                closest_index = self._closest_index(points, current_waypoint.transform.location)
+                last_edge = len(route)-i <= 2
+                if last_edge:
+                    delta = points - (destination.x, destination.y, destination.z)
+                    near_destination = np.sqrt(np.einsum('ij,ij->i', delta, delta)) < 2*resolution
+                    past_destination = closest_index > self._closest_index(
+                        points, destination_waypoint.transform.location)
+                for k in range(closest_index, len(points)):
+                    if k == 0:
+                        current_waypoint = edge['entry_waypoint']
+                    elif k == len(points) - 1:
+                        current_waypoint = edge['exit_waypoint']
+                    else:
+                        current_waypoint = edge['path'][k-1]
                     route_trace.append((current_waypoint, road_option))
-                    if len(route)-i <= 2 and waypoint.transform.location.distance(destination) < 2*resolution:
+                    if last_edge and near_destination[k]:
                         break
-                    elif len(route)-i <= 2 and current_waypoint.road_id == destination_waypoint.road_id and current_waypoint.section_id == destination_waypoint.section_id and current_waypoint.lane_id == destination_waypoint.lane_id:
-                        destination_index = self._find_closest_in_list(destination_waypoint, path)
-                        if closest_index > destination_index:
+                    elif last_edge and current_waypoint.road_id == destination_waypoint.road_id and current_waypoint.section_id == destination_waypoint.section_id and current_waypoint.lane_id == destination_waypoint.lane_id:
+                        if past_destination:
                             break
 
         return route_trace
@@ -0,0 +1,205 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides a persistent on-disk cache of the GlobalRoutePlanner graph.
+"""
+
+import os
+import pickle
+import re
+import tempfile
+
+import numpy as np
+
+from agents.navigation.local_planner import RoadOption
+
+# Bump whenever the layout of the cached data changes
+CACHE_VERSION = 2
+
+
+def waypoint_record(waypoint):
+    """
+    Converts a carla.Waypoint into a plain record that can be serialized:
+    (road_id, section_id, lane_id, s, (x, y, z, pitch, yaw, roll))
+    """
+    transform = waypoint.transform
+    location, rotation = transform.location, transform.rotation
+    return (waypoint.road_id, waypoint.section_id, waypoint.lane_id, waypoint.s,
+            (location.x, location.y, location.z, rotation.pitch, rotation.yaw, rotation.roll))
+
+
+class LazyWaypointList(object):
+    """
+    Read-only list of waypoints restored from records. A waypoint is requested
+    from the map only the first time it is accessed, so loading a cached graph
+    does not touch the map at all.
+    """
+
+    def __init__(self, records, dao):
+        self.records = records
+        self._dao = dao
+        self._waypoints = [None] * len(records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self.records)))]
+        waypoint = self._waypoints[index]
+        if waypoint is None:
+            road_id, _, lane_id, s, _ = self.records[index]
+            waypoint = self._dao.get_waypoint_xodr(road_id, lane_id, s)
+            self._waypoints[index] = waypoint
+        return waypoint
+
+    def __iter__(self):
+        for i in range(len(self.records)):
+            yield self[i]
+
+    def __add__(self, other):
+        return self[:] + list(other)
+
+    def __radd__(self, other):
+        return list(other) + self[:]
+
+
+def _is_waypoint(value):
+    return hasattr(value, 'road_id') and hasattr(value, 'transform')
+
+
+class _Packer(object):
+    """Converts attribute values into plain tagged values, sharing one record list per waypoint list."""
+
+    def __init__(self):
+        self._lists = dict()
+
+    def pack(self, value):
+        if _is_waypoint(value):
+            return ('wp', waypoint_record(value))
+        if isinstance(value, LazyWaypointList):
+            return ('wps', value.records)
+        if isinstance(value, list) and value and _is_waypoint(value[0]):
+            key = id(value)
+            if key not in self._lists:
+                self._lists[key] = [waypoint_record(w) for w in value]
+            return ('wps', self._lists[key])
+        if isinstance(value, np.ndarray):
+            return ('nd', value.tolist())
+        if isinstance(value, RoadOption):
+            return ('ro', value.value)
+        return ('raw', value)
+
+
+class _Unpacker(object):
+    """Restores packed values, sharing one lazy list per packed waypoint list."""
+
+    def __init__(self, dao):
+        self._dao = dao
+        self._lists = dict()
+
+    def unpack(self, packed):
+        tag, value = packed
+        if tag == 'wp':
+            road_id, _, lane_id, s, _ = value
+            waypoint = self._dao.get_waypoint_xodr(road_id, lane_id, s)
+            if waypoint is None:
+                raise ValueError('waypoint {} is not in the map'.format(value))
+            return waypoint
+        if tag == 'wps':
+            key = id(value)
+            if key not in self._lists:
+                self._lists[key] = LazyWaypointList(value, self._dao)
+            return self._lists[key]
+        if tag == 'nd':
+            return np.array(value)
+        if tag == 'ro':
+            return RoadOption(value)
+        return value
+
+
+class GlobalRoutePlannerCache(object):
+    """
+    Stores the topology and the graph built by GlobalRoutePlanner in a
+    versioned file keyed by map name, OpenDRIVE hash and sampling resolution.
+    """
+
+    def __init__(self, cache_dir):
+        """
+        Constructor
+
+            :param cache_dir: directory holding the cache files
+        """
+        self._cache_dir = cache_dir
+
+    def _key(self, dao):
+        return (dao.get_map_name(), dao.get_opendrive_hash(), float(dao.get_resolution()))
+
+    def _file(self, key):
+        map_name = re.sub(r'[^A-Za-z0-9_.-]', '_', key[0].split('/')[-1])
+        return os.path.join(self._cache_dir, '{}_{}_{:g}.grp'.format(map_name, key[1][:16], key[2]))
+
+    def load(self, dao):
+        """
+        Loads the cached state for the map of the dao.
+
+            :return: dictionary with topology, graph nodes and edges, id_map,
+                road_id_to_edge and landmarks, or None if there is no valid cache entry
+        """
+        key = self._key(dao)
+        # A stale or foreign file may fail to unpickle in many ways, all of
+        # which mean the graph has to be rebuilt
+        try:
+            with open(self._file(key), 'rb') as cache_file:
+                data = pickle.load(cache_file)
+        except Exception:  # pylint: disable=broad-except
+            return None
+        if not isinstance(data, dict) or data.get('version') != CACHE_VERSION or data.get('key') != key:
+            return None
+
+        unpacker = _Unpacker(dao)
+        try:
+            topology = [{name: unpacker.unpack(value) for name, value in segment.items()}
+                        for segment in data['topology']]
+            edges = [(n1, n2, {name: unpacker.unpack(value) for name, value in attributes.items()})
+                     for n1, n2, attributes in data['edges']]
+            return {'topology': topology, 'nodes': data['nodes'], 'edges': edges,
+                    'id_map': data['id_map'], 'road_id_to_edge': data['road_id_to_edge'],
+                    'landmarks': data['landmarks']}
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return None
+
+    def store(self, dao, topology, nodes, edges, id_map, road_id_to_edge, landmarks=None):
+        """
+        Writes the state to the cache file of the map of the dao.
+
+            :param topology: list of segment dictionaries (see GlobalRoutePlannerDAO.get_topology)
+            :param nodes: list of (node_id, vertex)
+            :param edges: list of (n1, n2, attributes)
+            :param id_map: map with structure {(x,y,z): id, ... }
+            :param road_id_to_edge: map with structure {road_id: {section_id: {lane_id: edge}}}
+            :param landmarks: landmark state of the graph (see RouteGraph.landmark_state) or None
+        """
+        key = self._key(dao)
+        packer = _Packer()
+        data = {
+            'version': CACHE_VERSION,
+            'key': key,
+            'topology': [{name: packer.pack(value) for name, value in segment.items()} for segment in topology],
+            'nodes': nodes,
+            'edges': [(n1, n2, {name: packer.pack(value) for name, value in attributes.items()})
+                      for n1, n2, attributes in edges],
+            'id_map': id_map,
+            'road_id_to_edge': road_id_to_edge,
+            'landmarks': landmarks,
+        }
+        if not os.path.isdir(self._cache_dir):
+            os.makedirs(self._cache_dir)
+        # Write to a temporary file first so a crash never leaves a truncated cache
+        handle, tmp_path = tempfile.mkstemp(dir=self._cache_dir, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as cache_file:
+            pickle.dump(data, cache_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._file(key))
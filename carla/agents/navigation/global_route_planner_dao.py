@@ -7,6 +7,9 @@
 This module provides implementation for GlobalRoutePlannerDAO
 """
 
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
 
@@ -16,15 +19,20 @@ class GlobalRoutePlannerDAO(object):
     from the carla server instance for GlobalRoutePlanner
     """
 
-    def __init__(self, wmap, sampling_resolution):
+    def __init__(self, wmap, sampling_resolution, workers=1, progress=None):
         """
         Constructor method.
 
             :param wmap: carla.world object
             :param sampling_resolution: sampling distance between waypoints
+            :param workers: number of threads sampling topology segments
+            :param progress: optional callable progress(done, total), called
+                by get_topology after every sampled segment
         """
         self._sampling_resolution = sampling_resolution
         self._wmap = wmap
+        self._workers = workers
+        self._progress = progress
 
     def get_topology(self):
         """
@@ -41,29 +49,57 @@ class GlobalRoutePlannerDAO(object):
                 path    -   list of waypoints separated by 1m from entry
                             to exit
         """
+        return self.sample_segments(self._wmap.get_topology())
+
+    def sample_segments(self, segments):
+        """
+        Samples waypoints of road segments.
+
+            :param segments: list of (entry, exit) waypoint pairs,
+                as returned by carla.Map.get_topology
+            :return topology: list of dictionary objects described in get_topology
+        """
+        if self._workers > 1:
+            # Segments are independent, map() keeps them in the original order
+            with ThreadPoolExecutor(max_workers=self._workers) as executor:
+                return self._collect(executor.map(self._sample_segment, segments), len(segments))
+        return self._collect((self._sample_segment(segment) for segment in segments), len(segments))
+
+    def _collect(self, seg_dicts, total):
+        """ Gathers sampled segments into a list, reporting progress """
         topology = []
-        # Retrieving waypoints to construct a detailed topology
-        for segment in self._wmap.get_topology():
-            wp1, wp2 = segment[0], segment[1]
-            l1, l2 = wp1.transform.location, wp2.transform.location
-            # Rounding off to avoid floating point imprecision
-            x1, y1, z1, x2, y2, z2 = np.round([l1.x, l1.y, l1.z, l2.x, l2.y, l2.z], 0)
-            wp1.transform.location, wp2.transform.location = l1, l2
-            seg_dict = dict()
-            seg_dict['entry'], seg_dict['exit'] = wp1, wp2
-            seg_dict['entryxyz'], seg_dict['exitxyz'] = (x1, y1, z1), (x2, y2, z2)
-            seg_dict['path'] = []
-            endloc = wp2.transform.location
-            if wp1.transform.location.distance(endloc) > self._sampling_resolution:
-                w = wp1.next(self._sampling_resolution)[0]
-                while w.transform.location.distance(endloc) > self._sampling_resolution:
-                    seg_dict['path'].append(w)
-                    w = w.next(self._sampling_resolution)[0]
-            else:
-                seg_dict['path'].append(wp1.next(self._sampling_resolution)[0])
+        for seg_dict in seg_dicts:
             topology.append(seg_dict)
+            if self._progress is not None:
+                self._progress(len(topology), total)
         return topology
 
+    def _sample_segment(self, segment):
+        """
+        Samples waypoints of one road segment.
+
+            :param segment: pair of waypoints (entry, exit)
+            :return seg_dict: dictionary described in get_topology
+        """
+        wp1, wp2 = segment[0], segment[1]
+        l1, l2 = wp1.transform.location, wp2.transform.location
+        # Rounding off to avoid floating point imprecision
+        x1, y1, z1, x2, y2, z2 = np.round([l1.x, l1.y, l1.z, l2.x, l2.y, l2.z], 0)
+        wp1.transform.location, wp2.transform.location = l1, l2
+        seg_dict = dict()
+        seg_dict['entry'], seg_dict['exit'] = wp1, wp2
+        seg_dict['entryxyz'], seg_dict['exitxyz'] = (x1, y1, z1), (x2, y2, z2)
+        seg_dict['path'] = []
+        endloc = wp2.transform.location
+        if wp1.transform.location.distance(endloc) > self._sampling_resolution:
+            w = wp1.next(self._sampling_resolution)[0]
+            while w.transform.location.distance(endloc) > self._sampling_resolution:
+                seg_dict['path'].append(w)
+                w = w.next(self._sampling_resolution)[0]
+        else:
+            seg_dict['path'].append(wp1.next(self._sampling_resolution)[0])
+        return seg_dict
+
     def get_waypoint(self, location):
         """
         The method returns waypoint at given location
@@ -77,3 +113,22 @@ class GlobalRoutePlannerDAO(object):
     def get_resolution(self):
         """ Accessor for self._sampling_resolution """
         return self._sampling_resolution
+
+    def get_waypoint_xodr(self, road_id, lane_id, s):
+        """
+        The method returns waypoint at given OpenDRIVE position
+
+            :param road_id: OpenDRIVE road id
+            :param lane_id: OpenDRIVE lane id
+            :param s: distance along the road
+            :return waypoint: generated waypoint or None if the position does not exist
+        """
+        return self._wmap.get_waypoint_xodr(road_id, lane_id, s)
+
+    def get_map_name(self):
+        """ Accessor for the name of the map """
+        return self._wmap.name
+
+    def get_opendrive_hash(self):
+        """ Returns the sha1 hex digest of the OpenDRIVE content of the map """
+        return hashlib.sha1(self._wmap.to_opendrive().encode('utf-8')).hexdigest()
@@ -5,10 +5,12 @@
 
 """ This module contains a local planner to perform low-level waypoint following based on PID controllers. """
 
+from collections import OrderedDict
 from enum import Enum
-from collections import deque
 import random
 
+import numpy as np
+
 import carla
 from agents.navigation.controller import VehiclePIDController
 from agents.tools.misc import draw_waypoints
@@ -27,6 +29,135 @@ class RoadOption(Enum):
     CHANGELANERIGHT = 6
 
 
+class WaypointPlan(object):
+    """
+    Queue of (carla.Waypoint, RoadOption) stored as struct of arrays: the x, y, z,
+    yaw, arc length and option code of every entry live in numpy arrays, so the
+    per-tick queries of LocalPlanner never touch the waypoint objects. The transform
+    of a waypoint is read once, when it is appended. Consumed entries are skipped by
+    moving a cursor instead of being popped.
+
+    Indexing is relative to the cursor: plan[0] is the next entry, plan[-1] the last one.
+    """
+
+    def __init__(self):
+        self._capacity = 64
+        self._x = np.empty(self._capacity)
+        self._y = np.empty(self._capacity)
+        self._z = np.empty(self._capacity)
+        self._yaw = np.empty(self._capacity)
+        self._s = np.empty(self._capacity)
+        self._options = np.empty(self._capacity, dtype=np.int8)
+        self._waypoints = []
+        self._cursor = 0
+        self._end = 0
+
+    def __len__(self):
+        return self._end - self._cursor
+
+    def __getitem__(self, index):
+        """
+        Returns the (carla.Waypoint, RoadOption) entry index positions after the cursor.
+        """
+        length = self._end - self._cursor
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError('waypoint plan index out of range')
+        index += self._cursor
+        return self._waypoints[index], RoadOption(int(self._options[index]))
+
+    def clear(self):
+        """
+        Removes all entries.
+        """
+        del self._waypoints[:]
+        self._cursor = 0
+        self._end = 0
+
+    def _reserve(self, count):
+        """
+        Makes room for count more entries, dropping the consumed ones first.
+        """
+        if self._end + count <= self._capacity:
+            return
+        if self._cursor > 0:
+            size = self._end - self._cursor
+            for array in (self._x, self._y, self._z, self._yaw, self._s, self._options):
+                array[:size] = array[self._cursor:self._end]
+            del self._waypoints[:self._cursor]
+            self._cursor, self._end = 0, size
+        if self._end + count > self._capacity:
+            self._capacity = max(2 * self._capacity, self._end + count)
+            for name in ('_x', '_y', '_z', '_yaw', '_s', '_options'):
+                array = getattr(self, name)
+                grown = np.empty(self._capacity, dtype=array.dtype)
+                grown[:self._end] = array[:self._end]
+                setattr(self, name, grown)
+
+    def append(self, waypoint, road_option):
+        """
+        Adds (waypoint, road_option) at the end of the plan.
+        """
+        self.extend([(waypoint, road_option)])
+
+    def extend(self, plan):
+        """
+        Adds every (carla.Waypoint, RoadOption) of plan at the end of the plan.
+        """
+        plan = list(plan)
+        if not plan:
+            return
+        self._reserve(len(plan))
+        start, end = self._end, self._end + len(plan)
+        for i, (waypoint, road_option) in enumerate(plan, start):
+            location, rotation = waypoint.transform.location, waypoint.transform.rotation
+            self._x[i], self._y[i], self._z[i] = location.x, location.y, location.z
+            self._yaw[i] = rotation.yaw
+            self._options[i] = road_option.value
+            self._waypoints.append(waypoint)
+
+        # arc length continues from the previous last entry
+        first = max(start - 1, self._cursor)
+        steps = np.sqrt(np.diff(self._x[first:end]) ** 2 + np.diff(self._y[first:end]) ** 2 +
+                        np.diff(self._z[first:end]) ** 2)
+        if first == start:
+            self._s[start] = 0.0
+            self._s[start + 1:end] = np.cumsum(steps)
+        else:
+            self._s[start:end] = self._s[first] + np.cumsum(steps)
+        self._end = end
+
+    def distance_ahead(self):
+        """
+        Returns the arc length in meters from the next entry to the last one.
+        """
+        if self._end == self._cursor:
+            return 0.0
+        return float(self._s[self._end - 1] - self._s[self._cursor])
+
+    def advance(self, count):
+        """
+        Consumes the next count entries.
+        """
+        self._cursor = min(self._cursor + count, self._end)
+
+    def last_within(self, location, distance, count):
+        """
+        Returns the index of the last of the next count entries closer than distance to location,
+        -1 if there is none.
+
+        :param location: carla.Location
+        :param distance: distance in meters
+        :param count: number of entries to check
+        """
+        window = slice(self._cursor, min(self._cursor + count, self._end))
+        squared = (self._x[window] - location.x) ** 2 + (self._y[window] - location.y) ** 2 + \
+            (self._z[window] - location.z) ** 2
+        close = np.flatnonzero(squared < distance * distance)
+        return int(close[-1]) if close.size else -1
+
+
 class LocalPlanner(object):
     """
     LocalPlanner implements the basic behavior of following a trajectory of waypoints that is generated on-the-fly.
@@ -39,6 +170,12 @@ class LocalPlanner(object):
     # minimum distance to target waypoint as a percentage (e.g. within 90% of
     # total distance)
     MIN_DISTANCE_PERCENTAGE = 0.9
+    # seconds of driving covered by the waypoints generated ahead of the vehicle
+    HORIZON_TIME = 5.0
+    # maximum number of waypoints added to the horizon per step
+    HORIZON_STEPS = 2
+    # maximum number of forks whose branch options are cached
+    MAX_BRANCH_OPTIONS = 1024
 
     def __init__(self, vehicle, opt_dict=None):
         """
@@ -70,10 +207,14 @@ class LocalPlanner(object):
         self.target_waypoint = None
         self._vehicle_controller = None
         self._stop_waypoint_creation = None
-        # queue with tuples of (waypoint, RoadOption)
-        self._waypoints_queue = deque(maxlen=20000)
+        # plan with tuples of (waypoint, RoadOption): the first _buffered entries
+        # form the waypoint buffer, the rest is the waypoint queue
+        self._waypoint_plan = WaypointPlan()
+        self._max_queue_size = 20000
         self._buffer_size = 5
-        self._waypoint_buffer = deque(maxlen=self._buffer_size)
+        self._buffered = 0
+        # RoadOption of every branch after a fork, by id of the waypoint before it
+        self._branch_options = OrderedDict()
 
         # initializing controller
         self._init_controller(opt_dict)
@@ -148,11 +289,11 @@ class LocalPlanner(object):
         self._stop_waypoint_creation = False
 
         # compute initial waypoints
-        self._waypoints_queue.append((self._current_waypoint.next(self._sampling_radius)[0], RoadOption.LANEFOLLOW))
+        self._waypoint_plan.append(self._current_waypoint.next(self._sampling_radius)[0], RoadOption.LANEFOLLOW)
 
         self._target_road_option = RoadOption.LANEFOLLOW
-        # fill waypoint trajectory queue
-        self._compute_next_waypoints(k=200)
+        # fill the waypoint buffer, the rest of the horizon is added while driving
+        self._compute_next_waypoints(k=self._buffer_size)
 
     def set_speed(self, speed):
         """
@@ -171,11 +312,11 @@ class LocalPlanner(object):
         :return:
         """
         # check we do not overflow the queue
-        available_entries = self._waypoints_queue.maxlen - len(self._waypoints_queue)
+        available_entries = self._max_queue_size - self._queue_size()
         k = min(available_entries, k)
 
         for _ in range(k):
-            last_waypoint = self._waypoints_queue[-1][0]
+            last_waypoint = self._waypoint_plan[-1][0]
             next_waypoints = list(last_waypoint.next(self._sampling_radius))
 
             if len(next_waypoints) == 0:
@@ -186,13 +327,58 @@ class LocalPlanner(object):
                 road_option = RoadOption.LANEFOLLOW
             else:
                 # random choice between the possible options
-                road_options_list = _retrieve_options(
+                road_options_list = self._retrieve_branch_options(
                     next_waypoints, last_waypoint)
                 road_option = random.choice(road_options_list)
                 next_waypoint = next_waypoints[road_options_list.index(
                     road_option)]
 
-            self._waypoints_queue.append((next_waypoint, road_option))
+            self._waypoint_plan.append(next_waypoint, road_option)
+
+    def _queue_size(self):
+        """
+        Number of waypoints in the queue, i.e. planned but not buffered yet.
+        """
+        return len(self._waypoint_plan) - self._buffered
+
+    def _retrieve_branch_options(self, list_waypoints, current_waypoint):
+        """
+        Cached _retrieve_options: the branches after a waypoint do not change, so their
+        RoadOptions are computed only the first time the fork is reached. Only the
+        MAX_BRANCH_OPTIONS most recently reached forks are kept.
+
+        :param list_waypoints: list with the possible target waypoints after current_waypoint
+        :param current_waypoint: current active waypoint
+        :return: list of RoadOption enums, one per candidate in list_waypoints
+        """
+        options = self._branch_options.get(current_waypoint.id)
+        if options is None:
+            options = _retrieve_options(list_waypoints, current_waypoint)
+            self._branch_options[current_waypoint.id] = options
+            if len(self._branch_options) > self.MAX_BRANCH_OPTIONS:
+                self._branch_options.popitem(last=False)
+        else:
+            self._branch_options.move_to_end(current_waypoint.id)
+        return options
+
+    def _extend_horizon(self, ego=None):
+        """
+        Keeps enough waypoints ahead of the vehicle: always a full buffer after the
+        current one, and HORIZON_TIME seconds of driving at the target speed, or at the
+        current speed of the ego snapshot if that is higher. The speed of the vehicle is
+        not queried otherwise. The horizon grows by at most HORIZON_STEPS waypoints per
+        step so that no single step waits for a long series of waypoint queries.
+
+        :param ego: EgoSnapshot of the vehicle for this step or None
+        """
+        if self._stop_waypoint_creation:
+            return
+        if self._queue_size() < self._buffer_size:
+            self._compute_next_waypoints(k=self._buffer_size - self._queue_size())
+        speed = self._target_speed if ego is None else max(ego.speed, self._target_speed)
+        horizon = max(speed / 3.6 * self.HORIZON_TIME, self._sampling_radius * self._buffer_size)
+        if self._waypoint_plan.distance_ahead() < horizon:
+            self._compute_next_waypoints(k=self.HORIZON_STEPS)
 
     def set_global_plan(self, current_plan, stop_waypoint_creation=True):
         """
@@ -204,37 +390,31 @@ class LocalPlanner(object):
         :return:
         """
 
-        # Reset the queue
-        self._waypoints_queue.clear()
-        for elem in current_plan:
-            self._waypoints_queue.append(elem)
+        # Reset the queue and the forks seen on the previous plan
+        self._waypoint_plan.clear()
+        self._branch_options.clear()
+        self._waypoint_plan.extend(list(current_plan)[-self._max_queue_size:])
         self._target_road_option = RoadOption.LANEFOLLOW
 
         # and the buffer
-        self._waypoint_buffer.clear()
-        for _ in range(self._buffer_size):
-            if self._waypoints_queue:
-                self._waypoint_buffer.append(
-                    self._waypoints_queue.popleft())
-            else:
-                break
+        self._buffered = min(self._buffer_size, len(self._waypoint_plan))
 
         self._stop_waypoint_creation = stop_waypoint_creation
 
-    def run_step(self, debug=False):
+    def run_step(self, debug=False, ego=None):
         """
         Execute one step of local planning which involves running the longitudinal and lateral PID controllers to
         follow the waypoints trajectory.
 
         :param debug: boolean flag to activate waypoints debugging
+        :param ego: EgoSnapshot of the vehicle for this step, if None the state is queried from the vehicle
         :return: control to be applied
         """
 
         # not enough waypoints in the horizon? => add more!
-        if not self._stop_waypoint_creation and len(self._waypoints_queue) < int(self._waypoints_queue.maxlen * 0.5):
-            self._compute_next_waypoints(k=100)
+        self._extend_horizon(ego)
 
-        if len(self._waypoints_queue) == 0 and len(self._waypoint_buffer) == 0:
+        if len(self._waypoint_plan) == 0:
             control = carla.VehicleControl()
             control.steer = 0.0
             control.throttle = 0.0
@@ -245,34 +425,29 @@ class LocalPlanner(object):
             return control
 
         #   Buffering the waypoints
-        if not self._waypoint_buffer:
-            for _ in range(self._buffer_size):
-                if self._waypoints_queue:
-                    self._waypoint_buffer.append(
-                        self._waypoints_queue.popleft())
-                else:
-                    break
+        if not self._buffered:
+            self._buffered = min(self._buffer_size, len(self._waypoint_plan))
 
         # current vehicle waypoint
-        vehicle_transform = self._vehicle.get_transform()
-        self._current_waypoint = self._map.get_waypoint(vehicle_transform.location)
+        if ego is not None:
+            vehicle_transform = ego.transform
+            self._current_waypoint = ego.waypoint
+        else:
+            vehicle_transform = self._vehicle.get_transform()
+            self._current_waypoint = self._map.get_waypoint(vehicle_transform.location)
         # target waypoint
-        self.target_waypoint, self._target_road_option = self._waypoint_buffer[0]
+        self.target_waypoint, self._target_road_option = self._waypoint_plan[0]
         # move using PID controllers
-        control = self._vehicle_controller.run_step(self._target_speed, self.target_waypoint)
+        control = self._vehicle_controller.run_step(self._target_speed, self.target_waypoint, ego=ego)
 
         # purge the queue of obsolete waypoints
-        max_index = -1
-
-        for i, (waypoint, _) in enumerate(self._waypoint_buffer):
-            if waypoint.transform.location.distance(vehicle_transform.location) < self._min_distance:
-                max_index = i
+        max_index = self._waypoint_plan.last_within(vehicle_transform.location, self._min_distance, self._buffered)
         if max_index >= 0:
-            for i in range(max_index + 1):
-                self._waypoint_buffer.popleft()
+            self._waypoint_plan.advance(max_index + 1)
+            self._buffered -= max_index + 1
 
         if debug:
-            draw_waypoints(self._vehicle.get_world(), [self.target_waypoint], self._vehicle.get_location().z + 1.0)
+            draw_waypoints(self._vehicle.get_world(), [self.target_waypoint], vehicle_transform.location.z + 1.0)
 
         return control
 
@@ -282,7 +457,7 @@ class LocalPlanner(object):
 
         :return: boolean
         """
-        return len(self._waypoints_queue) == 0 and len(self._waypoint_buffer) == 0
+        return len(self._waypoint_plan) == 0
 
 def _retrieve_options(list_waypoints, current_waypoint):
     """
@@ -162,7 +162,7 @@ class LocalPlanner(object):
                 return None, RoadOption.VOID
         return None, RoadOption.VOID
 
-    def run_step(self, target_speed=None, debug=False):
+    def run_step(self, target_speed=None, debug=False, ego=None):
         """
         Execute one step of local planning which involves
         running the longitudinal and lateral PID controllers to
@@ -170,6 +170,8 @@ class LocalPlanner(object):
 
             :param target_speed: desired speed
             :param debug: boolean flag to activate waypoints debugging
+            :param ego: EgoSnapshot of the vehicle for this step, if None
+                the state is queried from the vehicle
             :return: control
         """
 
@@ -197,7 +199,12 @@ class LocalPlanner(object):
                     break
 
         # Current vehicle waypoint
-        self._current_waypoint = self._map.get_waypoint(self._vehicle.get_location())
+        if ego is not None:
+            vehicle_transform = ego.transform
+            self._current_waypoint = ego.waypoint
+        else:
+            vehicle_transform = self._vehicle.get_transform()
+            self._current_waypoint = self._map.get_waypoint(vehicle_transform.location)
 
         # Target waypoint
         self.target_waypoint, self.target_road_option = self._waypoint_buffer[0]
@@ -213,10 +220,9 @@ class LocalPlanner(object):
                                                     args_lateral=args_lat,
                                                     args_longitudinal=args_long)
 
-        control = self._pid_controller.run_step(self._target_speed, self.target_waypoint)
+        control = self._pid_controller.run_step(self._target_speed, self.target_waypoint, ego=ego)
 
         # Purge the queue of obsolete waypoints
-        vehicle_transform = self._vehicle.get_transform()
         max_index = -1
 
         for i, (waypoint, _) in enumerate(self._waypoint_buffer):
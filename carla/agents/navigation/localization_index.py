@@ -0,0 +1,121 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides LocalizationIndex, a client-side spatial index used by
+GlobalRoutePlanner to localize locations without querying the server.
+"""
+
+import math
+
+import numpy as np
+
+
+class LocalizationIndex(object):
+    """
+    Uniform grid over the lane center lines of the map. Every lane is added
+    as a polyline of sampled waypoints together with its key (for the planner
+    the (road_id, section_id, lane_id) triple). A query returns the key of the
+    closest lane, or None when the answer is not clear cut: the location is
+    off the lane or another lane is almost as close (e.g. at the start of
+    overlapping junction connectors). Callers then ask the server instead.
+    """
+
+    def __init__(self, cell_size=10.0, margin=0.5):
+        """
+        Constructor
+
+            :param cell_size: side of a grid cell in meters
+            :param margin: minimum distance in meters by which the closest lane
+                must beat every other lane for the answer to be accepted
+        """
+        self._cell_size = cell_size
+        self._margin = margin
+        self._polylines = []
+        self._cells = None
+        self._starts = None
+        self._ends = None
+        self._keys = None
+        self._half_widths = None
+        self._key_values = None
+        self.hits = 0
+        self.misses = 0
+
+    def add_lane(self, points, key, lane_width):
+        """
+        Adds a lane center line
+
+            :param points: sequence of (x, y, z) along the lane, at least two
+            :param key: value returned by query for this lane
+            :param lane_width: width of the lane in meters
+        """
+        points = np.asarray(points, dtype=np.float64)
+        if len(points) >= 2:
+            self._polylines.append((points, key, lane_width / 2.0))
+            self._cells = None
+
+    def _build(self):
+        """ Splits the polylines into segments and puts them into grid cells """
+        key_ids = dict()
+        starts, ends, keys, half_widths = [], [], [], []
+        for points, key, half_width in self._polylines:
+            key_id = key_ids.setdefault(key, len(key_ids))
+            starts.append(points[:-1])
+            ends.append(points[1:])
+            keys.append(np.full(len(points) - 1, key_id))
+            half_widths.append(np.full(len(points) - 1, half_width))
+        self._starts = np.concatenate(starts) if starts else np.zeros((0, 3))
+        self._ends = np.concatenate(ends) if ends else np.zeros((0, 3))
+        self._keys = np.concatenate(keys) if keys else np.zeros(0, dtype=int)
+        self._half_widths = np.concatenate(half_widths) if half_widths else np.zeros(0)
+        self._key_values = [None] * len(key_ids)
+        for key, key_id in key_ids.items():
+            self._key_values[key_id] = key
+
+        cells = dict()
+        low = np.floor(np.minimum(self._starts, self._ends)[:, :2] / self._cell_size).astype(int)
+        high = np.floor(np.maximum(self._starts, self._ends)[:, :2] / self._cell_size).astype(int)
+        for segment, (x0, y0, x1, y1) in enumerate(np.hstack((low, high)).tolist()):
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    cells.setdefault((cx, cy), []).append(segment)
+        self._cells = {cell: np.array(segments) for cell, segments in cells.items()}
+
+    def query(self, x, y, z):
+        """
+        Returns the key of the lane at the location or None if the index
+        cannot tell it reliably.
+        """
+        if self._cells is None:
+            self._build()
+        # Lanes further than this can not be accepted, so neither can they compete
+        reach = float(self._half_widths.max()) + self._margin if self._half_widths.size else 0.0
+        x0, x1 = int(math.floor((x - reach) / self._cell_size)), int(math.floor((x + reach) / self._cell_size))
+        y0, y1 = int(math.floor((y - reach) / self._cell_size)), int(math.floor((y + reach) / self._cell_size))
+        candidates = [self._cells[cell] for cell in
+                      ((cx, cy) for cx in range(x0, x1 + 1) for cy in range(y0, y1 + 1)) if cell in self._cells]
+        if not candidates:
+            self.misses += 1
+            return None
+        segments = np.unique(np.concatenate(candidates))
+
+        # Distance from the location to every candidate segment
+        point = np.array([x, y, z])
+        starts = self._starts[segments]
+        direction = self._ends[segments] - starts
+        squared_length = np.einsum('ij,ij->i', direction, direction)
+        t = np.einsum('ij,ij->i', point - starts, direction) / np.where(squared_length > 0, squared_length, 1.0)
+        closest = starts + direction * np.clip(t, 0.0, 1.0)[:, None]
+        distances = np.linalg.norm(closest - point, axis=1)
+
+        best = np.argmin(distances)
+        best_key = self._keys[segments[best]]
+        others = distances[self._keys[segments] != best_key]
+        if distances[best] > self._half_widths[segments[best]] or \
+                (others.size and others.min() - distances[best] < self._margin):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._key_values[best_key]
@@ -46,8 +46,11 @@ class RoamingAgent(Agent):
         vehicle_list = actor_list.filter("*vehicle*")
         lights_list = actor_list.filter("*traffic_light*")
 
+        # state of the ego vehicle shared by every check of this step
+        ego = self.get_ego_snapshot()
+
         # check possible obstacles
-        vehicle_state, vehicle = self._is_vehicle_hazard(vehicle_list)
+        vehicle_state, vehicle = self._is_vehicle_hazard(vehicle_list, ego)
         if vehicle_state:
             if debug:
                 print('!!! VEHICLE BLOCKING AHEAD [{}])'.format(vehicle.id))
@@ -56,7 +59,7 @@ class RoamingAgent(Agent):
             hazard_detected = True
 
         # check for the state of the traffic lights
-        light_state, traffic_light = self._is_light_red(lights_list)
+        light_state, traffic_light = self._is_light_red(lights_list, ego)
         if light_state:
             if debug:
                 print('=== RED LIGHT AHEAD [{}])'.format(traffic_light.id))
@@ -69,6 +72,6 @@ class RoamingAgent(Agent):
         else:
             self._state = AgentState.NAVIGATING
             # standard local planner behavior
-            control = self._local_planner.run_step()
+            control = self._local_planner.run_step(ego=ego)
 
         return control
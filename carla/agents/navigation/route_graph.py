@@ -0,0 +1,434 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides RouteGraph, a compact directed graph used by
+GlobalRoutePlanner in place of networkx.
+"""
+
+import heapq
+from itertools import count
+
+import numpy as np
+
+
+HEURISTIC_EUCLIDEAN = 'euclidean'
+HEURISTIC_LANDMARKS = 'landmarks'
+HEURISTIC_NONE = 'none'
+HEURISTICS = (HEURISTIC_EUCLIDEAN, HEURISTIC_LANDMARKS, HEURISTIC_NONE)
+
+
+class NoRouteError(Exception):
+    """
+    Raised when there is no path between two nodes of a RouteGraph
+    """
+
+
+class _NodeView(object):
+    """ Read-only mapping {node: {'vertex': (x, y, z)}} """
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __getitem__(self, node):
+        return self._graph._node_data[node]
+
+    def __contains__(self, node):
+        return node in self._graph._node_data
+
+    def __iter__(self):
+        return iter(self._graph._node_data)
+
+    def __len__(self):
+        return len(self._graph._node_data)
+
+    def items(self):
+        return self._graph._node_data.items()
+
+
+class _EdgeView(object):
+    """ Read-only mapping {(n1, n2): attributes} """
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __getitem__(self, edge):
+        return self._graph._edge_data[edge]
+
+    def __contains__(self, edge):
+        return edge in self._graph._edge_data
+
+    def __iter__(self):
+        return iter(self._graph._edge_data)
+
+    def __len__(self):
+        return len(self._graph._edge_data)
+
+    def data(self):
+        """ Iterates over (n1, n2, attributes) """
+        for (n1, n2), attributes in self._graph._edge_data.items():
+            yield n1, n2, attributes
+
+
+class ShortestPathTree(object):
+    """
+    Result of a single-source search on a RouteGraph: cost and path
+    from the source to every reachable node.
+    """
+
+    def __init__(self, graph, source, distances, parents):
+        # The dense indices are only valid for the graph as it was searched
+        self._node_index = graph._node_index
+        self._node_ids = graph._node_ids
+        self.source = source
+        self._distances = distances
+        self._parents = parents
+
+    def distance(self, node):
+        """ Returns the cost from the source to node, inf if node is unreachable """
+        return self._distances.get(self._node_index.get(node), float('inf'))
+
+    def path(self, node):
+        """
+        Returns the list of node ids from the source to node
+
+            :raises NoRouteError: if node is unreachable
+        """
+        index = self._node_index.get(node)
+        if index not in self._distances:
+            raise NoRouteError("Node {} is not reachable from {}".format(node, self.source))
+        path = []
+        while index is not None:
+            path.append(self._node_ids[index])
+            index = self._parents[index]
+        path.reverse()
+        return path
+
+
+class RouteGraph(object):
+    """
+    Directed graph with the subset of the networkx.DiGraph interface used by
+    GlobalRoutePlanner (add_node, add_edge, remove_node, remove_edge, nodes[n],
+    edges[n1, n2], successors, predecessors).
+
+    Node ids are arbitrary hashable values (the planner uses negative ids for
+    loose ends), so every node is also given a dense index. For searching,
+    the graph is compiled into CSR adjacency arrays over dense indices, with
+    float32 node coordinates and the edge weights in a parallel array.
+    The compiled form is rebuilt lazily after the graph is modified.
+    """
+
+    def __init__(self):
+        self._node_data = dict()     # node -> {'vertex': (x, y, z)}
+        self._edge_data = dict()     # (n1, n2) -> attributes, in insertion order
+        self._successors = dict()    # node -> {successor: None}, in insertion order
+        self._predecessors = dict()  # node -> {predecessor: None}
+        self._node_index = dict()    # node -> dense index, set by _compile
+        self._node_ids = []          # dense index -> node, set by _compile
+        self.nodes = _NodeView(self)
+        self.edges = _EdgeView(self)
+        self._compiled = False
+        self._coordinates = None
+        self._indptr = None
+        self._indices = None
+        self._weights = None
+        self._indptr_list = None
+        self._indices_list = None
+        self._weights_list = None
+        self._reverse_lists = None
+        self._landmarks = None
+        self._landmark_from = None
+        self._landmark_to = None
+        self.expansions = 0
+
+    def add_node(self, node, vertex):
+        """
+        Adds a node or updates its position
+
+            :param node: node id
+            :param vertex: (x, y, z) position of the node
+        """
+        if node not in self._node_data:
+            self._node_data[node] = {'vertex': vertex}
+            self._successors[node] = dict()
+            self._predecessors[node] = dict()
+        else:
+            self._node_data[node]['vertex'] = vertex
+        self._compiled = False
+
+    def add_edge(self, n1, n2, **attributes):
+        """
+        Adds an edge or updates the attributes of an existing one.
+        Missing end nodes are added without a position, as networkx does.
+
+            :param n1: source node id
+            :param n2: target node id
+            :param attributes: edge attributes, 'length' is the search weight
+        """
+        for node in (n1, n2):
+            if node not in self._node_data:
+                self.add_node(node, None)
+        if (n1, n2) in self._edge_data:
+            self._edge_data[n1, n2].update(attributes)
+        else:
+            self._edge_data[n1, n2] = attributes
+            self._successors[n1][n2] = None
+            self._predecessors[n2][n1] = None
+        self._compiled = False
+
+    def remove_edge(self, n1, n2):
+        """ Removes the edge from n1 to n2 """
+        del self._edge_data[n1, n2]
+        del self._successors[n1][n2]
+        del self._predecessors[n2][n1]
+        self._compiled = False
+
+    def remove_node(self, node):
+        """ Removes node together with all its edges """
+        for successor in list(self._successors[node]):
+            self.remove_edge(node, successor)
+        for predecessor in list(self._predecessors[node]):
+            self.remove_edge(predecessor, node)
+        del self._node_data[node]
+        del self._successors[node]
+        del self._predecessors[node]
+        self._compiled = False
+
+    def successors(self, node):
+        """ Returns the successors of node in the order their edges were added """
+        return list(self._successors[node])
+
+    def predecessors(self, node):
+        """ Returns the predecessors of node """
+        return list(self._predecessors[node])
+
+    def _compile(self):
+        """ Builds the CSR arrays from the node and edge dictionaries """
+        if self._compiled:
+            return
+        # Landmark distances are only valid for the graph they were computed on
+        self._landmarks = None
+        self._node_ids = list(self._node_data)
+        self._node_index = {node: i for i, node in enumerate(self._node_ids)}
+        node_count = len(self._node_ids)
+        coordinates = np.zeros((node_count, 3), dtype=np.float32)
+        for i, node in enumerate(self._node_ids):
+            vertex = self._node_data[node]['vertex']
+            if vertex is not None:
+                coordinates[i] = vertex
+
+        index = self._node_index
+        edge_keys = list(self._edge_data)
+        sources = np.fromiter((index[n1] for n1, _ in edge_keys), dtype=np.int64, count=len(edge_keys))
+        targets = np.fromiter((index[n2] for _, n2 in edge_keys), dtype=np.int64, count=len(edge_keys))
+        weights = np.fromiter((self._edge_data[key]['length'] for key in edge_keys),
+                              dtype=np.float64, count=len(edge_keys))
+        # A stable sort keeps the successors of each node in insertion order,
+        # which keeps tie-breaking identical to networkx
+        order = np.argsort(sources, kind='stable')
+        self._coordinates = coordinates
+        self._indptr = np.concatenate(([0], np.cumsum(np.bincount(sources, minlength=node_count))))
+        self._indices = targets[order]
+        self._weights = weights[order]
+        # The search loop works on scalars, which Python lists serve much
+        # faster than numpy element access
+        self._indptr_list = self._indptr.tolist()
+        self._indices_list = self._indices.tolist()
+        self._weights_list = self._weights.tolist()
+        # Reversed adjacency, used to compute distances towards landmarks
+        reverse_order = np.argsort(targets, kind='stable')
+        reverse_indptr = np.concatenate(([0], np.cumsum(np.bincount(targets, minlength=node_count))))
+        self._reverse_lists = (reverse_indptr.tolist(), sources[reverse_order].tolist(),
+                               weights[reverse_order].tolist())
+        self._compiled = True
+
+    def distances_to(self, node):
+        """
+        Returns the straight line distance from every node to node,
+        as an array indexed by dense node index
+        """
+        self._compile()
+        delta = self._coordinates - self._coordinates[self._node_index[node]]
+        return np.sqrt(np.einsum('ij,ij->i', delta, delta, dtype=np.float64))
+
+    def has_landmarks(self):
+        """ Returns True if landmarks are available for the current graph """
+        self._compile()
+        return self._landmarks is not None
+
+    def build_landmarks(self, landmark_count):
+        """
+        Selects landmarks and computes the distances from and to each of them,
+        which give the lower bounds used by astar (ALT: A*, landmarks and
+        triangle inequality). Landmarks are picked far apart: the first one
+        at the border of the map, each next one the node farthest by road
+        from those already picked. Any change of the graph drops them.
+
+            :param landmark_count: maximum number of landmarks
+        """
+        self._compile()
+        node_count = len(self._node_ids)
+        landmarks, distances_from, distances_to = [], [], []
+        if node_count:
+            center = self._coordinates.mean(axis=0)
+            pick = int(np.argmax(np.linalg.norm(self._coordinates - center, axis=1)))
+            score = np.full(node_count, np.inf)
+            for _ in range(landmark_count):
+                landmarks.append(pick)
+                distances_from.append(self._distance_array(pick, self._indptr_list, self._indices_list,
+                                                           self._weights_list))
+                distances_to.append(self._distance_array(pick, *self._reverse_lists))
+                # Nodes cut off from a landmark make poor landmarks themselves
+                round_trip = distances_from[-1] + distances_to[-1]
+                score = np.minimum(score, np.where(np.isfinite(round_trip), round_trip, -1.0))
+                score[landmarks] = -1.0
+                pick = int(np.argmax(score))
+                if score[pick] <= 0:
+                    break
+        self._landmarks = landmarks
+        self._landmark_from = np.array(distances_from).T if landmarks else np.zeros((node_count, 0))
+        self._landmark_to = np.array(distances_to).T if landmarks else np.zeros((node_count, 0))
+
+    def landmark_state(self):
+        """ Returns the landmarks and their distances as plain data, None if there are none """
+        if not self.has_landmarks():
+            return None
+        return {'nodes': list(self._node_ids), 'landmarks': [self._node_ids[i] for i in self._landmarks],
+                'from': self._landmark_from, 'to': self._landmark_to}
+
+    def set_landmark_state(self, state):
+        """
+        Restores landmarks returned by landmark_state
+
+            :return: True if the state matches the nodes of the graph
+        """
+        self._compile()
+        if state is None or state['nodes'] != self._node_ids:
+            return False
+        self._landmarks = [self._node_index[node] for node in state['landmarks']]
+        self._landmark_from = state['from']
+        self._landmark_to = state['to']
+        return True
+
+    def _landmark_bounds(self, goal):
+        """
+        Returns the lower bound of the road distance from every node to goal,
+        derived from the landmark distances by the triangle inequality
+        """
+        with np.errstate(invalid='ignore'):
+            bounds = np.concatenate((self._landmark_to - self._landmark_to[goal],
+                                     self._landmark_from[goal] - self._landmark_from), axis=1)
+        # inf - inf: the landmark tells nothing about this pair
+        bounds = np.where(np.isnan(bounds), 0.0, bounds)
+        return np.maximum(bounds.max(axis=1, initial=0.0), 0.0)
+
+    def _distance_array(self, start, indptr, indices, weights):
+        """ Returns the array of Dijkstra distances from dense index start, inf if unreachable """
+        distances = np.full(len(self._node_ids), np.inf)
+        found, _ = self._dijkstra(start, indptr, indices, weights)
+        distances[list(found)] = list(found.values())
+        return distances
+
+    def astar(self, source, target, heuristic=HEURISTIC_EUCLIDEAN):
+        """
+        A* search with 'length' as edge weight.
+        HEURISTIC_EUCLIDEAN is the straight line distance; expansion order and
+        tie-breaking follow networkx.astar_path, so both return the same path.
+        HEURISTIC_LANDMARKS is the ALT lower bound (see build_landmarks, falls
+        back to the straight line distance without landmarks), which returns
+        a shortest path expanding far fewer nodes than HEURISTIC_NONE, plain
+        Dijkstra stopped at the target.
+        The number of expanded nodes is added to self.expansions.
+
+            :param source: start node id
+            :param target: goal node id
+            :param heuristic: one of HEURISTICS
+            :return: list of node ids from source to target
+        """
+        self._compile()
+        if source not in self._node_index or target not in self._node_index:
+            raise NoRouteError("Node {} or {} is not in the graph".format(source, target))
+        start, goal = self._node_index[source], self._node_index[target]
+        if heuristic == HEURISTIC_NONE:
+            estimates = [0.0] * len(self._node_ids)
+        elif heuristic == HEURISTIC_LANDMARKS and self._landmarks is not None:
+            estimates = self._landmark_bounds(goal).tolist()
+        else:
+            estimates = self.distances_to(target).tolist()
+        indptr, indices, weights = self._indptr_list, self._indices_list, self._weights_list
+
+        counter = count()
+        queue = [(0, next(counter), start, 0, None)]
+        enqueued = dict()
+        explored = dict()
+        while queue:
+            _, _, current, distance, parent = heapq.heappop(queue)
+            if current == goal:
+                path = [current]
+                node = parent
+                while node is not None:
+                    path.append(node)
+                    node = explored[node]
+                path.reverse()
+                return [self._node_ids[i] for i in path]
+            if current in explored:
+                if explored[current] is None:
+                    continue
+                if enqueued[current][0] < distance:
+                    continue
+            explored[current] = parent
+            self.expansions += 1
+            for k in range(indptr[current], indptr[current + 1]):
+                neighbor = indices[k]
+                new_cost = distance + weights[k]
+                if neighbor in enqueued:
+                    queued_cost, h = enqueued[neighbor]
+                    if queued_cost <= new_cost:
+                        continue
+                else:
+                    h = estimates[neighbor]
+                enqueued[neighbor] = new_cost, h
+                heapq.heappush(queue, (new_cost + h, next(counter), neighbor, new_cost, current))
+        raise NoRouteError("Node {} is not reachable from {}".format(target, source))
+
+    def shortest_path_tree(self, source):
+        """
+        Dijkstra search from source to every node, using 'length' as edge weight.
+        One tree answers the queries from source to any number of targets.
+
+            :param source: start node id
+            :return: ShortestPathTree
+        """
+        self._compile()
+        if source not in self._node_index:
+            raise NoRouteError("Node {} is not in the graph".format(source))
+        distances, parents = self._dijkstra(
+            self._node_index[source], self._indptr_list, self._indices_list, self._weights_list)
+        return ShortestPathTree(self, source, distances, parents)
+
+    def _dijkstra(self, start, indptr, indices, weights):
+        """
+        Dijkstra search over CSR lists from dense index start
+
+            :return: (distances, parents) dictionaries keyed by dense index
+        """
+        counter = count()
+        queue = [(0, next(counter), start, None)]
+        distances = dict()
+        parents = dict()
+        seen = {start: 0}
+        while queue:
+            distance, _, current, parent = heapq.heappop(queue)
+            if current in distances:
+                continue
+            distances[current] = distance
+            parents[current] = parent
+            for k in range(indptr[current], indptr[current + 1]):
+                neighbor = indices[k]
+                new_cost = distance + weights[k]
+                if neighbor not in distances and new_cost < seen.get(neighbor, float('inf')):
+                    seen[neighbor] = new_cost
+                    heapq.heappush(queue, (new_cost, next(counter), neighbor, current))
+        return distances, parents
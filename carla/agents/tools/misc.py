@@ -28,6 +28,39 @@ def draw_waypoints(world, waypoints, z=0.5):
         world.debug.draw_arrow(begin, end, arrow_size=0.3, life_time=1.0)
 
 
+class EgoSnapshot(object):
+    """
+    State of a vehicle captured once per simulation frame, so that agent, local
+    planner and controller do not ask the simulator for it again and again within
+    one step. Transform, location, velocity and speed are read on construction,
+    the waypoint is looked up in the map the first time it is needed.
+    """
+
+    def __init__(self, vehicle, world_map, frame=None):
+        """
+        :param vehicle: the vehicle whose state is captured
+        :param world_map: carla.Map used to look up the waypoint of the vehicle
+        :param frame: simulation frame the state belongs to
+        """
+        self.vehicle = vehicle
+        self.frame = frame
+        self.transform = vehicle.get_transform()
+        self.location = self.transform.location
+        self.velocity = vehicle.get_velocity()
+        self.speed = 3.6 * math.sqrt(self.velocity.x ** 2 + self.velocity.y ** 2 + self.velocity.z ** 2)
+        self._map = world_map
+        self._waypoint = None
+
+    @property
+    def waypoint(self):
+        """
+        Waypoint of the map at the location of the vehicle.
+        """
+        if self._waypoint is None:
+            self._waypoint = self._map.get_waypoint(self.location)
+        return self._waypoint
+
+
 def get_speed(vehicle):
     """
     Compute speed of a vehicle in Km/h.
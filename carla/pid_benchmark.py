@@ -0,0 +1,283 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Checks the PID kernels of controller.py against the numpy implementation they
+replaced, and FleetPIDController against one VehiclePIDController per vehicle,
+then measures the kernels. Runs offline, no simulator is needed:
+
+    python pid_benchmark.py --steps 100000
+
+The parity checks also run as tests (test_pid_parity.py).
+"""
+
+import argparse
+import collections
+import glob
+import math
+import os
+import random
+import sys
+import time
+from collections import deque
+
+try:
+    sys.path.append(glob.glob('dist/carla-*%d.%d-%s.egg' % (
+        sys.version_info.major,
+        sys.version_info.minor,
+        'win-amd64' if os.name == 'nt' else 'linux-x86_64'))[0])
+except IndexError:
+    pass
+
+import carla
+import numpy as np
+
+from agents.navigation.controller import FleetPIDController, PIDLateralController, PIDLongitudinalController, \
+    VehiclePIDController
+
+Target = collections.namedtuple('Target', 'transform')
+
+# Largest accepted difference between the kernels and the reference
+TOLERANCE = 1e-9
+
+
+class ReferenceLongitudinal(object):
+    """ PIDLongitudinalController._pid_control as it was with numpy and a deque """
+
+    def __init__(self, K_P=1.0, K_D=0.0, K_I=0.0, dt=0.03):
+        self._k_p, self._k_d, self._k_i, self._dt = K_P, K_D, K_I, dt
+        self._error_buffer = deque(maxlen=10)
+
+    def _pid_control(self, target_speed, current_speed):
+        error = target_speed - current_speed
+        self._error_buffer.append(error)
+        if len(self._error_buffer) >= 2:
+            _de = (self._error_buffer[-1] - self._error_buffer[-2]) / self._dt
+            _ie = sum(self._error_buffer) * self._dt
+        else:
+            _de = 0.0
+            _ie = 0.0
+        return np.clip((self._k_p * error) + (self._k_d * _de) + (self._k_i * _ie), -1.0, 1.0)
+
+
+class ReferenceLateral(object):
+    """ PIDLateralController._pid_control as it was with numpy and a deque """
+
+    def __init__(self, offset=0, K_P=1.0, K_D=0.0, K_I=0.0, dt=0.03):
+        self._k_p, self._k_d, self._k_i, self._dt = K_P, K_D, K_I, dt
+        self._offset = offset
+        self._e_buffer = deque(maxlen=10)
+
+    def _pid_control(self, waypoint, vehicle_transform):
+        ego_loc = vehicle_transform.location
+        v_vec = vehicle_transform.get_forward_vector()
+        v_vec = np.array([v_vec.x, v_vec.y, 0.0])
+        if self._offset != 0:
+            w_tran = waypoint.transform
+            r_vec = w_tran.get_right_vector()
+            w_loc = w_tran.location + carla.Location(x=self._offset*r_vec.x,
+                                                     y=self._offset*r_vec.y)
+        else:
+            w_loc = waypoint.transform.location
+        w_vec = np.array([w_loc.x - ego_loc.x,
+                          w_loc.y - ego_loc.y,
+                          0.0])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            _dot = math.acos(np.clip(np.dot(w_vec, v_vec) /
+                                     (np.linalg.norm(w_vec) * np.linalg.norm(v_vec)), -1.0, 1.0))
+            _cross = np.cross(v_vec, w_vec)
+        if _cross[2] < 0:
+            _dot *= -1.0
+        self._e_buffer.append(_dot)
+        if len(self._e_buffer) >= 2:
+            _de = (self._e_buffer[-1] - self._e_buffer[-2]) / self._dt
+            _ie = sum(self._e_buffer) * self._dt
+        else:
+            _de = 0.0
+            _ie = 0.0
+        return np.clip((self._k_p * _dot) + (self._k_d * _de) + (self._k_i * _ie), -1.0, 1.0)
+
+
+def random_transform():
+    return carla.Transform(carla.Location(x=random.uniform(-100, 100), y=random.uniform(-100, 100)),
+                           carla.Rotation(pitch=random.uniform(-5, 5), yaw=random.uniform(-180, 180)))
+
+
+def degenerate_input(kind):
+    """
+    Input that drives the kernels into NaN or infinity: the waypoint at the
+    ego location (0/0 heading), infinite speeds or an infinitely far waypoint.
+    """
+    transform = random_transform()
+    if kind == 0:
+        return random.uniform(0, 60), random.uniform(0, 60), Target(transform), transform
+    if kind == 1:
+        return math.inf, random.uniform(0, 60), Target(random_transform()), transform
+    if kind == 2:
+        return math.inf, math.inf, Target(random_transform()), transform
+    far = carla.Transform(carla.Location(x=math.inf, y=random.uniform(-100, 100)), carla.Rotation())
+    return random.uniform(0, 60), -math.inf, Target(far), transform
+
+
+def make_inputs(steps, seed, degenerate=False):
+    """
+    Random (target_speed, current_speed, waypoint, vehicle_transform) per step.
+    With degenerate, every 25th step is a degenerate input, so NaN and infinite
+    errors enter the error history and leave it again.
+    """
+    random.seed(seed)
+    inputs = []
+    for step in range(steps):
+        if degenerate and step % 25 == 24:
+            inputs.append(degenerate_input(step // 25 % 4))
+        else:
+            inputs.append((random.uniform(0, 60), random.uniform(0, 60), Target(random_transform()),
+                           random_transform()))
+    return inputs
+
+
+def difference(value, reference):
+    """
+    Difference of two outputs: NaN on both sides counts as equal, NaN on one
+    side only as infinitely different.
+    """
+    if math.isnan(value) or math.isnan(reference):
+        return 0.0 if math.isnan(value) and math.isnan(reference) else math.inf
+    if value == reference:
+        return 0.0
+    return abs(value - reference)
+
+
+def check_parity(inputs, offset):
+    """ Returns the largest difference between both implementations over the inputs """
+    args = {'K_P': 1.95, 'K_D': 0.2, 'K_I': 0.07, 'dt': 0.05}
+    longitudinal, reference_longitudinal = PIDLongitudinalController(None, **args), ReferenceLongitudinal(**args)
+    lateral, reference_lateral = PIDLateralController(None, offset, **args), ReferenceLateral(offset, **args)
+    worst = 0.0
+    for target_speed, current_speed, waypoint, transform in inputs:
+        worst = max(worst,
+                    difference(longitudinal._pid_control(target_speed, current_speed),
+                               reference_longitudinal._pid_control(target_speed, current_speed)),
+                    difference(lateral._pid_control(waypoint, transform),
+                               reference_lateral._pid_control(waypoint, transform)))
+    return worst
+
+
+class StubVehicle(object):
+    """ Vehicle whose state is set by the check instead of a simulator """
+
+    def __init__(self, actor_id, world):
+        self.id = actor_id
+        self._world = world
+        self.transform = random_transform()
+        self.velocity = carla.Vector3D()
+
+    def get_world(self):
+        return self._world
+
+    def get_transform(self):
+        return self.transform
+
+    def get_velocity(self):
+        return self.velocity
+
+    def get_control(self):
+        return carla.VehicleControl(steer=0.1)
+
+
+class StubSnapshot(object):
+    """ World snapshot of the stub vehicles, find(actor_id) returns the vehicle itself """
+
+    def __init__(self, vehicles):
+        self._vehicles = {vehicle.id: vehicle for vehicle in vehicles}
+
+    def find(self, actor_id):
+        return self._vehicles.get(actor_id)
+
+
+class StubWorld(object):
+    """ World and client at once: hands out snapshots and collects the batches applied """
+
+    def __init__(self):
+        self.vehicles = []
+        self.batches = []
+
+    def get_world(self):
+        return self
+
+    def get_snapshot(self):
+        return StubSnapshot(self.vehicles)
+
+    def apply_batch(self, commands):
+        self.batches.append(commands)
+
+
+def check_fleet_parity(vehicle_count, steps, offset, seed=0):
+    """
+    Returns the largest difference between the controls of FleetPIDController and
+    those of one VehiclePIDController per vehicle, over random vehicle states.
+    """
+    random.seed(seed)
+    lateral = {'K_P': 1.95, 'K_D': 0.2, 'K_I': 0.07, 'dt': 0.05}
+    longitudinal = {'K_P': 1.0, 'K_D': 0.1, 'K_I': 0.05, 'dt': 0.05}
+    world = StubWorld()
+    world.vehicles = [StubVehicle(actor_id, world) for actor_id in range(vehicle_count)]
+    controllers = [VehiclePIDController(vehicle, lateral, longitudinal, offset=offset) for vehicle in world.vehicles]
+    fleet = FleetPIDController(world, world.vehicles, lateral, longitudinal, offset=offset)
+    worst = 0.0
+    for _ in range(steps):
+        for vehicle in world.vehicles:
+            vehicle.transform = random_transform()
+            vehicle.velocity = carla.Vector3D(random.uniform(-8, 8), random.uniform(-8, 8), random.uniform(-1, 1))
+        waypoints = [Target(random_transform()) for _ in world.vehicles]
+        speeds = [random.uniform(0, 40) for _ in world.vehicles]
+        expected = [controller.run_step(speed, waypoint)
+                    for controller, speed, waypoint in zip(controllers, speeds, waypoints)]
+        for single, batched in zip(expected, fleet.run_step(speeds, waypoints, apply=False)):
+            worst = max(worst, difference(batched.throttle, single.throttle),
+                        difference(batched.brake, single.brake), difference(batched.steer, single.steer))
+    return worst
+
+
+def measure(controllers, inputs):
+    """ Seconds per call of the longitudinal and the lateral kernel """
+    longitudinal, lateral = controllers
+    begin = time.perf_counter()
+    for target_speed, current_speed, _, _ in inputs:
+        longitudinal._pid_control(target_speed, current_speed)
+    middle = time.perf_counter()
+    for _, _, waypoint, transform in inputs:
+        lateral._pid_control(waypoint, transform)
+    end = time.perf_counter()
+    return (middle - begin) / len(inputs), (end - middle) / len(inputs)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument('--steps', default=100000, type=int, help='number of control steps (default: 100000)')
+    argparser.add_argument('--seed', default=0, type=int, help='random seed (default: 0)')
+    args = argparser.parse_args()
+
+    checked = make_inputs(args.steps, args.seed, degenerate=True)
+    for offset in (0, 0.5):
+        worst = check_parity(checked, offset)
+        print('offset {}: largest difference {:.3g}'.format(offset, worst))
+        if not worst <= TOLERANCE:
+            sys.exit('PID kernels do not match the reference implementation')
+        worst = check_fleet_parity(50, 40, offset, args.seed)
+        print('offset {}: largest fleet difference {:.3g}'.format(offset, worst))
+        if not worst <= TOLERANCE:
+            sys.exit('FleetPIDController does not match VehiclePIDController')
+
+    inputs = make_inputs(args.steps, args.seed)
+    current = measure((PIDLongitudinalController(None), PIDLateralController(None)), inputs)
+    reference = measure((ReferenceLongitudinal(), ReferenceLateral()), inputs)
+    print('{:<14}{:>14}{:>14}'.format('us per call', 'reference', 'current'))
+    for name, before, after in zip(('longitudinal', 'lateral'), reference, current):
+        print('{:<14}{:>14.2f}{:>14.2f}'.format(name, before * 1e6, after * 1e6))
+
+
+if __name__ == '__main__':
+    main()
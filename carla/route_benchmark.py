@@ -0,0 +1,110 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Compares the route search heuristics of GlobalRoutePlanner on the current
+map of a running simulator: the straight line distance (default), ALT
+landmarks and none (Dijkstra), which is the reference for shortest routes:
+
+    python route_benchmark.py --pairs 200 --landmarks 16
+"""
+
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+
+try:
+    sys.path.append(glob.glob('dist/carla-*%d.%d-%s.egg' % (
+        sys.version_info.major,
+        sys.version_info.minor,
+        'win-amd64' if os.name == 'nt' else 'linux-x86_64'))[0])
+except IndexError:
+    pass
+
+import carla
+import numpy as np
+
+from agents.navigation.global_route_planner import GlobalRoutePlanner
+from agents.navigation.global_route_planner_dao import GlobalRoutePlannerDAO
+from agents.navigation.route_graph import HEURISTICS
+
+
+def route_cost(graph, route):
+    """ Sum of the edge lengths of a route given as list of node ids """
+    return sum(graph.edges[route[i], route[i + 1]]['length'] for i in range(len(route) - 1))
+
+
+def search(graph, edge_pairs, heuristic):
+    """
+    Runs the route search for every pair of localized edges.
+
+        :return: (list of seconds per query, list of expansions per query, list of costs)
+    """
+    times, expansions, costs = [], [], []
+    for start, end in edge_pairs:
+        before = graph.expansions
+        begin = time.perf_counter()
+        route = graph.astar(start[0], end[0], heuristic)
+        times.append(time.perf_counter() - begin)
+        expansions.append(graph.expansions - before)
+        costs.append(route_cost(graph, route))
+    return times, expansions, costs
+
+
+def run_benchmark(carla_map, locations, pair_count, resolution, landmarks, seed=0):
+    """
+    Benchmarks both heuristics on random pairs of locations and prints a summary.
+    """
+    dao = GlobalRoutePlannerDAO(carla_map, resolution)
+    begin = time.perf_counter()
+    planner = GlobalRoutePlanner(dao, route_cache_size=0)
+    planner.setup()
+    setup_time = time.perf_counter() - begin
+    graph = planner._graph
+    begin = time.perf_counter()
+    graph.build_landmarks(landmarks)
+    landmark_time = time.perf_counter() - begin
+
+    random.seed(seed)
+    edge_pairs = []
+    while len(edge_pairs) < pair_count:
+        start, end = planner._localize(random.choice(locations)), planner._localize(random.choice(locations))
+        if start is not None and end is not None and graph.shortest_path_tree(start[0]).distance(end[0]) < np.inf:
+            edge_pairs.append((start, end))
+
+    optimal = [graph.shortest_path_tree(start[0]).distance(end[0]) for start, end in edge_pairs]
+    print('Map {}: {} nodes, {} edges, setup {:.2f}s, {} landmarks in {:.2f}s'.format(
+        carla_map.name, len(graph.nodes), len(graph.edges), setup_time, landmarks, landmark_time))
+    print('{:<12}{:>12}{:>12}{:>14}{:>12}'.format('heuristic', 'mean ms', 'p95 ms', 'expansions', 'optimal'))
+    for heuristic in HEURISTICS:
+        times, expansions, costs = search(graph, edge_pairs, heuristic)
+        times_ms = np.array(times) * 1000.0
+        exact = sum(1 for cost, best in zip(costs, optimal) if cost == best)
+        print('{:<12}{:>12.3f}{:>12.3f}{:>14.1f}{:>8}/{:<3}'.format(
+            heuristic, times_ms.mean(), np.percentile(times_ms, 95), np.mean(expansions), exact, len(costs)))
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument('--host', default='127.0.0.1', help='IP of the host server (default: 127.0.0.1)')
+    argparser.add_argument('-p', '--port', default=2000, type=int, help='TCP port to listen to (default: 2000)')
+    argparser.add_argument('--pairs', default=200, type=int, help='number of random routes (default: 200)')
+    argparser.add_argument('--landmarks', default=16, type=int, help='number of ALT landmarks (default: 16)')
+    argparser.add_argument('--resolution', default=2.0, type=float, help='sampling resolution (default: 2.0)')
+    argparser.add_argument('--seed', default=0, type=int, help='random seed (default: 0)')
+    args = argparser.parse_args()
+
+    client = carla.Client(args.host, args.port)
+    client.set_timeout(10.0)
+    carla_map = client.get_world().get_map()
+    locations = [point.location for point in carla_map.get_spawn_points()]
+    run_benchmark(carla_map, locations, args.pairs, args.resolution, args.landmarks, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Parity tests of the PID controllers against the implementation they replaced
+and of FleetPIDController against VehiclePIDController (see pid_benchmark.py). Run from this directory, no simulator is needed:
+
+    python -m unittest test_pid_parity
+"""
+
+import math
+import unittest
+
+from agents.navigation.controller import FleetPIDController
+from pid_benchmark import TOLERANCE, StubWorld, check_fleet_parity, check_parity, difference, make_inputs
+
+
+class PIDParityTest(unittest.TestCase):
+    """ The PID kernels give the outputs of the reference implementation """
+
+    def test_difference(self):
+        self.assertEqual(difference(math.nan, math.nan), 0.0)
+        self.assertEqual(difference(math.nan, 0.5), math.inf)
+        self.assertEqual(difference(-1.0, math.nan), math.inf)
+        self.assertEqual(difference(math.inf, math.inf), 0.0)
+
+    def test_random_inputs(self):
+        inputs = make_inputs(5000, seed=0)
+        for offset in (0, 0.5):
+            self.assertLessEqual(check_parity(inputs, offset), TOLERANCE)
+
+    def test_degenerate_inputs(self):
+        inputs = make_inputs(5000, seed=1, degenerate=True)
+        for offset in (0, 0.5):
+            self.assertLessEqual(check_parity(inputs, offset), TOLERANCE)
+
+
+class FleetParityTest(unittest.TestCase):
+    """ FleetPIDController gives the controls of one VehiclePIDController per vehicle """
+
+    def test_fleet(self):
+        for offset in (0, 0.7):
+            self.assertLessEqual(check_fleet_parity(50, 40, offset), TOLERANCE)
+
+    def test_empty_fleet(self):
+        world = StubWorld()
+        fleet = FleetPIDController(world, [], {}, {})
+        self.assertEqual(fleet.run_step([], []), [])
+        self.assertEqual(world.batches, [[]])
+
+
+if __name__ == '__main__':
+    unittest.main()
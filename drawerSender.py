@@ -0,0 +1,52 @@
+import asyncio
+from reconnectBackoff import ReconnectBackoff
+
+'''
+* @author: vladddd46
+* @brief:  Drawer link. Sends applied steer-wheel angles to drawer
+*          (graphics/angleGraphics.py), which plots them.
+*          Only the newest angle is sent: if drawer is slower than balancer,
+*          intermediate angles are skipped. Runs as coroutine in
+*          transport`s event loop, only if --drawer_on is set.
+*          Every angle is terminated by ANGLE_DELIMITER, so drawer can split
+*          stream back into angles.
+'''
+
+ANGLE_DELIMITER = b'\n'
+
+
+class DrawerChannel(object):
+	def __init__(self):
+		self._angle = None
+		self._event = asyncio.Event()
+
+	def publish(self, angle):
+		self._angle = angle
+		self._event.set()
+
+	async def next(self):
+		await self._event.wait()
+		self._event.clear()
+		return self._angle
+
+
+async def sendAnglesToDrawer(channel, parsedArgs):
+	backoff = ReconnectBackoff()
+	while True:
+		try:
+			reader, writer = await asyncio.open_connection(parsedArgs.drawer_ip, parsedArgs.drawer_port)
+		except OSError as e:
+			print("Exception while connecting to drawer: ", e)
+			await asyncio.sleep(backoff.next())
+			continue
+		backoff.reset()
+
+		try:
+			while True:
+				angle = await channel.next()
+				writer.write(bytes(str(angle), 'utf-8') + ANGLE_DELIMITER)
+				await writer.drain()
+		except (OSError, ConnectionError) as e:
+			print("Connection with drawer is lost: ", e)
+		finally:
+			writer.close()
@@ -0,0 +1,64 @@
+import threading
+
+'''
+* @author: vladddd46
+* @brief:  Decoding of sensor frames (camera, lidar, dvs) outside of carla
+*          sensor`s callback thread. Callback only submits raw frame;
+*          pool of worker threads decodes it and hands result to consumer.
+*          Latest frame wins: if workers are busy, pending frame is replaced
+*          by newer one, so decoding never falls behind and callbacks of
+*          other sensors (imu) never wait for camera frames.
+'''
+
+
+class FrameProcessor(object):
+	def __init__(self, decode, onDecoded, workers=1):
+		'''
+		decode    - callable(frame) -> result, runs in worker thread.
+		onDecoded - callable(frameId, result), runs in worker thread.
+		'''
+		self._decode    = decode
+		self._onDecoded = onDecoded
+		self._condition = threading.Condition()
+		self._pending   = None
+		self._stopped   = False
+		self.submitted  = 0
+		self.dropped    = 0
+		self.decoded    = 0
+		self._threads   = [threading.Thread(target=self._work, name="frame-processor-%d" % i, daemon=True)
+						   for i in range(max(1, workers))]
+		for thread in self._threads:
+			thread.start()
+
+	def submit(self, frameId, frame):
+		'''Called from sensor`s callback. Never blocks on decoding.'''
+		with self._condition:
+			if self._pending is not None:
+				self.dropped += 1
+			self._pending = (frameId, frame)
+			self.submitted += 1
+			self._condition.notify()
+
+	def stop(self):
+		with self._condition:
+			self._stopped = True
+			self._pending = None
+			self._condition.notify_all()
+		for thread in self._threads:
+			if thread is not threading.current_thread():
+				thread.join()
+
+	def _work(self):
+		while True:
+			with self._condition:
+				self._condition.wait_for(lambda: self._pending is not None or self._stopped)
+				if self._stopped:
+					return
+				frameId, frame = self._pending
+				self._pending = None
+			try:
+				result = self._decode(frame)
+				self._onDecoded(frameId, result)
+				self.decoded += 1
+			except Exception as e:
+				print("Exception while decoding frame %d: " % frameId, e)
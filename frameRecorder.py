@@ -0,0 +1,160 @@
+import os
+import queue
+import threading
+import time
+import zipfile
+
+'''
+* @author: vladddd46
+* @brief:  Recording of sensor frames (CameraManager.toggle_recording).
+*          Sensor`s callback only copies raw bytes of frame into bounded
+*          queue; background thread writes frames in batches. If writer
+*          falls behind, new frames are dropped and counted.
+*          Every recording session is written into its own directory
+*          (<directory>/<YYYYmmdd_HHMMSS>[_N]) in one of containers:
+*          - raw - chunk_NNNNN.bin files with raw frames one after another
+*                  (new chunk is started after CHUNK_SIZE bytes) and
+*                  index.csv: frame,sensor,width,height,points,chunk,offset,size
+*          - zip - frames.zip with deflate-compressed raw frames (NNNNNNNN.raw)
+*                  and index.csv: frame,sensor,width,height,points,entry,size
+*          Raw frame of camera is BGRA pixels (width * height * 4 bytes)
+*          after colour converter of selected view (points is 0).
+*          Raw frame of lidar is points (x, y, z, intensity as float32),
+*          width and height are 0.
+'''
+
+CONTAINER_RAW = 'raw'
+CONTAINER_ZIP = 'zip'
+CONTAINERS    = (CONTAINER_RAW, CONTAINER_ZIP)
+
+CHUNK_SIZE = 256 * 1024 * 1024
+# Max count of frames written between two flushes.
+BATCH_SIZE = 16
+
+
+class _RawChunksWriter(object):
+	def __init__(self, path):
+		self._path   = path
+		self._chunk  = -1
+		self._file   = None
+		self._offset = 0
+		self._index  = open(os.path.join(path, 'index.csv'), 'w')
+		self._index.write("frame,sensor,width,height,points,chunk,offset,size\n")
+
+	def write(self, frameId, sensor, width, height, points, data):
+		if self._file is None or self._offset + len(data) > CHUNK_SIZE:
+			self._nextChunk()
+		self._file.write(data)
+		self._index.write("%d,%s,%d,%d,%d,%d,%d,%d\n" % (
+			frameId, sensor, width, height, points, self._chunk, self._offset, len(data)))
+		self._offset += len(data)
+
+	def flush(self):
+		if self._file is not None:
+			self._file.flush()
+		self._index.flush()
+
+	def close(self):
+		if self._file is not None:
+			self._file.close()
+		self._index.close()
+
+	def _nextChunk(self):
+		if self._file is not None:
+			self._file.close()
+		self._chunk += 1
+		self._offset = 0
+		self._file = open(os.path.join(self._path, 'chunk_%05d.bin' % self._chunk), 'wb')
+
+
+class _ZipWriter(object):
+	def __init__(self, path):
+		self._archive = zipfile.ZipFile(os.path.join(path, 'frames.zip'), 'w',
+										compression=zipfile.ZIP_DEFLATED, compresslevel=1)
+		self._index = ["frame,sensor,width,height,points,entry,size\n"]
+
+	def write(self, frameId, sensor, width, height, points, data):
+		entry = '%08d.raw' % frameId
+		self._archive.writestr(entry, data)
+		self._index.append("%d,%s,%d,%d,%d,%s,%d\n" % (frameId, sensor, width, height, points, entry, len(data)))
+
+	def flush(self):
+		pass
+
+	def close(self):
+		self._archive.writestr('index.csv', ''.join(self._index))
+		self._archive.close()
+
+
+class FrameRecorder(object):
+	def __init__(self, directory='_out', container=CONTAINER_RAW, maxQueue=64):
+		self._directory = directory
+		self._container = container
+		self._queue     = queue.Queue(maxsize=maxQueue)
+		self._thread    = None
+		self.path       = None
+		self.submitted  = 0
+		self.written    = 0
+		self.dropped    = 0
+		self.bytes      = 0
+
+	def start(self):
+		path = os.path.join(self._directory, time.strftime('%Y%m%d_%H%M%S'))
+		self.path, session = path, 1
+		while os.path.exists(self.path):
+			session += 1
+			self.path = '%s_%d' % (path, session)
+		os.makedirs(self.path)
+		if self._container == CONTAINER_ZIP:
+			writer = _ZipWriter(self.path)
+		else:
+			writer = _RawChunksWriter(self.path)
+		self._thread = threading.Thread(target=self._work, args=(writer,), name="frame-recorder", daemon=True)
+		self._thread.start()
+
+	def submit(self, frameId, sensor, width, height, data, points=0):
+		'''Called from sensor`s callback. Never blocks.'''
+		self.submitted += 1
+		try:
+			self._queue.put_nowait((frameId, sensor, width, height, points, bytes(data)))
+		except queue.Full:
+			self.dropped += 1
+
+	def stop(self):
+		'''Writes frames left in queue and closes container.'''
+		if self._thread is None:
+			return
+		if self._thread.is_alive():
+			self._queue.put(None)
+		self._thread.join()
+		self._thread = None
+
+	def stats(self):
+		return {"path":      self.path,
+				"submitted": self.submitted,
+				"written":   self.written,
+				"dropped":   self.dropped,
+				"bytes":     self.bytes}
+
+	def _work(self, writer):
+		try:
+			stopped = False
+			while not stopped:
+				batch = [self._queue.get()]
+				while len(batch) < BATCH_SIZE:
+					try:
+						batch.append(self._queue.get_nowait())
+					except queue.Empty:
+						break
+				for frame in batch:
+					if frame is None:
+						stopped = True
+						break
+					writer.write(*frame)
+					self.written += 1
+					self.bytes += len(frame[5])
+				writer.flush()
+		except Exception as e:
+			print("Exception while recording frames: ", e)
+		finally:
+			writer.close()
@@ -27,27 +27,35 @@ while True:
 			axes.set_ylim(yMinLim, yMaxLim)
 			line, = axes.plot(xdata, ydata, 'r-')
 			 
+			# Angles are newline-terminated: one recv may hold several
+			# of them or only part of one.
+			pending = b''
 			for i in range(10000000):
-				try:
-					data = connectionSocket.recv(1024)
-					data = data.decode("utf-8")
-					print("==",data)
-					data = float(data)
-				except Exception as e:
-					print(e)
-					continue
-				passedTime = time.time() - startTime
-				if passedTime >= xMaxLim:
-					xMaxLim += 60
-					axes.set_xlim(xMinLim, xMaxLim)
+				data = connectionSocket.recv(1024)
+				if not data:
+					break
+				pending += data
+				*messages, pending = pending.split(b'\n')
+				for message in messages:
+					try:
+						angle = float(message.decode("utf-8"))
+					except Exception as e:
+						print(e)
+						continue
+					print("==", angle)
+					passedTime = time.time() - startTime
+					if passedTime >= xMaxLim:
+						xMaxLim += 60
+						axes.set_xlim(xMinLim, xMaxLim)
 
-				xdata.append(time.time() - startTime)
-				ydata.append(data)
+					xdata.append(time.time() - startTime)
+					ydata.append(angle)
 				line.set_xdata(xdata)
 				line.set_ydata(ydata)
 				plt.draw()
 				plt.pause(1e-17)
 				time.sleep(0.1)
+			break
 
 plt.show()
 sock.close()
@@ -0,0 +1,111 @@
+import json
+import struct
+
+'''
+* @author: vladddd46
+* @brief:  Serializers of IMU sensor`s data, which is sent to remote server.
+*          JsonImuSerializer     - legacy format: json object per sample,
+*                                  "id" key holds sequence number.
+*          BinaryImuSerializer   - compact fixed-layout frame:
+*
+*          offset size  field
+*          0      2     magic (b'IM')
+*          2      1     version of layout (IMU_BINARY_VERSION)
+*          3      1     flags (bit 0 set => payload fields are float64)
+*          4      4     sequence number (uint32, wraps around)
+*          8      8     simulation timestamp in seconds (float64)
+*          16     8     frame id (uint64)
+*          24     ...   accel.x/y/z, gyro.x/y/z, velocity.x/y/z
+*                       (9 x float32 or 9 x float64)
+*
+*          All fields are little-endian. Frame size is fixed for given
+*          precision (60 bytes for float32, 96 bytes for float64), so
+*          balancer can read frames from stream without extra delimiters.
+'''
+
+IMU_FORMAT_JSON   = 'json'
+IMU_FORMAT_BINARY = 'binary'
+IMU_FORMATS       = (IMU_FORMAT_JSON, IMU_FORMAT_BINARY)
+
+IMU_PRECISION_F32 = 'f32'
+IMU_PRECISION_F64 = 'f64'
+IMU_PRECISIONS    = (IMU_PRECISION_F32, IMU_PRECISION_F64)
+
+IMU_BINARY_MAGIC   = b'IM'
+IMU_BINARY_VERSION = 1
+IMU_FLAG_FLOAT64   = 0x01
+
+_HEADER_LAYOUT = '<2sBBIdQ'
+_FIELDS_COUNT  = 9
+
+
+class JsonImuSerializer(object):
+	def serialize(self, sequence, sensor_data, velocity):
+		accelerometerData = sensor_data.accelerometer
+		gyroscopeData     = sensor_data.gyroscope
+		sendData = {"accel": {"x": round(accelerometerData.x, 4),
+							  "y": round(accelerometerData.y, 4),
+							  "z": round(accelerometerData.z, 4)},
+					"gyro":  {"x": round(gyroscopeData.x, 4),
+							  "y": round(gyroscopeData.y, 4),
+							  "z": round(gyroscopeData.z, 4)},
+					"velocity": {"x":  round(velocity.x, 4),
+								 "y":  round(velocity.y, 4),
+								 "z":  round(velocity.z, 4)},
+					"id": sequence
+					}
+		print(sendData)
+		return bytes(json.dumps(sendData), 'utf-8')
+
+
+class BinaryImuSerializer(object):
+	def __init__(self, precision=IMU_PRECISION_F32):
+		if precision == IMU_PRECISION_F64:
+			self._flags = IMU_FLAG_FLOAT64
+			fieldCode   = 'd'
+		else:
+			self._flags = 0
+			fieldCode   = 'f'
+		# Header and payload are packed by one precompiled struct,
+		# so every sample costs exactly one pack() call.
+		self._struct = struct.Struct(_HEADER_LAYOUT + fieldCode * _FIELDS_COUNT)
+
+	@property
+	def frameSize(self):
+		return self._struct.size
+
+	def serialize(self, sequence, sensor_data, velocity):
+		accel = sensor_data.accelerometer
+		gyro  = sensor_data.gyroscope
+		return self._struct.pack(
+			IMU_BINARY_MAGIC, IMU_BINARY_VERSION, self._flags,
+			sequence & 0xFFFFFFFF, sensor_data.timestamp, sensor_data.frame,
+			accel.x, accel.y, accel.z,
+			gyro.x, gyro.y, gyro.z,
+			velocity.x, velocity.y, velocity.z)
+
+
+def decodeBinaryImuFrame(frame):
+	'''
+	Reference decoder of binary frame (used by balancer side and for debugging).
+	Returns dict with header fields and "accel", "gyro", "velocity" tuples.
+	'''
+	magic, version, flags, sequence, timestamp, frameId = struct.unpack_from(_HEADER_LAYOUT, frame)
+	if magic != IMU_BINARY_MAGIC:
+		raise ValueError("Wrong magic of imu frame: %r" % magic)
+	if version != IMU_BINARY_VERSION:
+		raise ValueError("Unsupported version of imu frame: %d" % version)
+	fieldCode = 'd' if flags & IMU_FLAG_FLOAT64 else 'f'
+	values = struct.unpack_from('<' + fieldCode * _FIELDS_COUNT, frame, struct.calcsize(_HEADER_LAYOUT))
+	return {"sequence":  sequence,
+			"timestamp": timestamp,
+			"frame":     frameId,
+			"accel":     values[0:3],
+			"gyro":      values[3:6],
+			"velocity":  values[6:9]}
+
+
+def createImuSerializer(parsedArgs):
+	if parsedArgs.imu_format == IMU_FORMAT_BINARY:
+		return BinaryImuSerializer(parsedArgs.imu_precision)
+	return JsonImuSerializer()
@@ -0,0 +1,119 @@
+import asyncio
+import bisect
+import os
+import time
+
+'''
+* @author: vladddd46
+* @brief:  Measurement of control-loop round trip: from IMU sample
+*          (IMU sensor`s callback) to applied steer-angle (after
+*          motorbike.apply_control). Every IMU sample carries id (sequence
+*          number); balancer echoes it back in steer-angle message:
+*
+*              {"angle": 0.12, "id": 1234}\n
+*
+*          Round trip times are collected into histogram with log-spaced
+*          buckets. Once per `period` seconds percentiles of collected
+*          samples are published (HUD overlay reads them) and, if csv path
+*          is set, appended to csv file. Histogram is written only from
+*          transport`s event loop, readers only take published summary,
+*          so no locks are needed.
+'''
+
+# Bucket upper bounds in seconds: 10us..10s, 10% apart.
+_BUCKET_BOUNDS = []
+_bound = 1e-5
+while _bound < 10.0:
+	_BUCKET_BOUNDS.append(_bound)
+	_bound *= 1.1
+_BUCKET_BOUNDS.append(float('inf'))
+
+# Size of table of stamped, not yet answered samples.
+_PENDING_SIZE = 4096
+
+CSV_HEADER = "time,count,p50_ms,p95_ms,p99_ms,max_ms,unmatched\n"
+
+
+class LatencyHistogram(object):
+	def __init__(self):
+		self.counts = [0] * len(_BUCKET_BOUNDS)
+		self.count  = 0
+		self.max    = 0.0
+
+	def record(self, seconds):
+		self.counts[bisect.bisect_left(_BUCKET_BOUNDS, seconds)] += 1
+		self.count += 1
+		if seconds > self.max:
+			self.max = seconds
+
+	def percentile(self, fraction):
+		'''Upper bound of bucket, which holds given fraction of samples (seconds).'''
+		if not self.count:
+			return 0.0
+		rank = fraction * self.count
+		accumulated = 0
+		for i, bucketCount in enumerate(self.counts):
+			accumulated += bucketCount
+			if accumulated >= rank:
+				return min(_BUCKET_BOUNDS[i], self.max)
+		return self.max
+
+
+class LatencyMonitor(object):
+	def __init__(self, csvPath=None, period=1.0):
+		self._csvPath    = csvPath
+		self.period      = period # seconds, which every summary covers.
+		self._ids        = [-1] * _PENDING_SIZE
+		self._stampedAt  = [0.0] * _PENDING_SIZE
+		self._histogram  = LatencyHistogram()
+		self._unmatched  = 0
+		self.summary     = None # dict with last published percentiles (milliseconds).
+
+	def stamp(self, sampleId):
+		'''Called, when IMU sample is produced (any thread).'''
+		index = sampleId % _PENDING_SIZE
+		self._stampedAt[index] = time.perf_counter()
+		self._ids[index] = sampleId
+
+	def complete(self, sampleId):
+		'''Called from event loop, when steer-angle for sample is applied.'''
+		now = time.perf_counter()
+		index = sampleId % _PENDING_SIZE
+		if self._ids[index] != sampleId:
+			self._unmatched += 1 # too old or unknown id.
+			return
+		self._ids[index] = -1
+		self._histogram.record(now - self._stampedAt[index])
+
+	def publish(self):
+		histogram, self._histogram = self._histogram, LatencyHistogram()
+		unmatched, self._unmatched = self._unmatched, 0
+		summary = {"time":      time.time(),
+				   "count":     histogram.count,
+				   "p50":       1000.0 * histogram.percentile(0.50),
+				   "p95":       1000.0 * histogram.percentile(0.95),
+				   "p99":       1000.0 * histogram.percentile(0.99),
+				   "max":       1000.0 * histogram.max,
+				   "unmatched": unmatched}
+		self.summary = summary
+		return summary
+
+	async def run(self):
+		csvFile = None
+		try:
+			if self._csvPath:
+				writeHeader = not os.path.exists(self._csvPath) or os.path.getsize(self._csvPath) == 0
+				csvFile = open(self._csvPath, 'a')
+				if writeHeader:
+					csvFile.write(CSV_HEADER)
+			while True:
+				await asyncio.sleep(self.period)
+				summary = self.publish()
+				if csvFile is not None:
+					csvFile.write("%.3f,%d,%.3f,%.3f,%.3f,%.3f,%d\n" % (
+						summary["time"], summary["count"], summary["p50"],
+						summary["p95"], summary["p99"], summary["max"], summary["unmatched"]))
+					csvFile.flush()
+		finally:
+			if csvFile is not None:
+				csvFile.close()
@@ -43,6 +43,7 @@ import logging
 import math
 import random
 import re
+import threading
 import weakref
 
 try:
@@ -93,11 +94,11 @@ except ImportError:
 	raise RuntimeError('cannot import numpy, make sure numpy package is installed')
 
 #my imports
-from receiver        import *
-from sender          import *
 from argsParser      import *
-from multiprocessing import Queue
-import threading
+from imuSerializer   import createImuSerializer
+from transport       import Transport
+from frameProcessor  import FrameProcessor
+from frameRecorder   import FrameRecorder
 import json
 
 # ==============================================================================
@@ -123,6 +124,7 @@ def get_actor_display_name(actor, truncate=250):
 class World(object):
 	def __init__(self, carla_world, hud, args, qForSendingImuDataToBalancerModule):
 		self.world = carla_world
+		self.imu_serializer = createImuSerializer(args)
 		self.actor_role_name = args.rolename
 		try:
 			self.map = self.world.get_map()
@@ -140,8 +142,15 @@ class World(object):
 		self._weather_index = 0
 		self._actor_filter = args.filter
 		self._gamma = args.gamma
+		# Headless world has neither hud nor camera: only imu pipeline is left.
+		self._headless = args.headless
+		self._camera_workers = args.camera_workers
+		self._new_frame_recorder = lambda: FrameRecorder(args.record_dir, args.record_format, args.record_queue)
+		# In synchronous mode imu must produce sample on every world tick.
+		self._imu_sensor_tick = '0.0' if args.sync else '0.1'
 		self.restart()
-		self.world.on_tick(hud.on_world_tick)
+		if hud is not None:
+			self.world.on_tick(hud.on_world_tick)
 		self.recording_enabled = False
 		self.recording_start = 0
 		self.constant_velocity_enabled = False
@@ -202,10 +211,12 @@ class World(object):
 			self.player = self.world.try_spawn_actor(blueprint, spawn_point)
 			self.modify_vehicle_physics(self.player)
 		# Set up the sensors.
-		self.imu_sensor = IMUSensor(self.player, self.qForSendingImuDataToBalancerModule)
-		self.camera_manager = CameraManager(self.player, self.hud, self._gamma)
-		self.camera_manager.transform_index = cam_pos_index
-		self.camera_manager.set_sensor(cam_index, notify=False)
+		self.imu_sensor = IMUSensor(self.player, self.qForSendingImuDataToBalancerModule, self.imu_serializer, self._imu_sensor_tick)
+		if not self._headless:
+			self.camera_manager = CameraManager(
+				self.player, self.hud, self._gamma, self._camera_workers, self._new_frame_recorder)
+			self.camera_manager.transform_index = cam_pos_index
+			self.camera_manager.set_sensor(cam_index, notify=False)
 		actor_type = get_actor_display_name(self.player)
 
 	def next_weather(self, reverse=False):
@@ -236,9 +247,12 @@ class World(object):
 			pass
 
 	def render(self, display):
-		self.camera_manager.render(display)
+		if self.camera_manager is not None:
+			self.camera_manager.render(display)
 
 	def destroy_sensors(self):
+		if self.camera_manager is None:
+			return
 		self.camera_manager.sensor.destroy()
 		self.camera_manager.sensor = None
 		self.camera_manager.index = None
@@ -247,16 +261,57 @@ class World(object):
 		# if self.radar_sensor is not None:
 		# 	self.toggle_radar()
 		sensors = [
-			self.camera_manager.sensor,
+			self.camera_manager.sensor if self.camera_manager is not None else None,
 			self.imu_sensor.sensor]
 		for sensor in sensors:
 			if sensor is not None:
 				sensor.stop()
 				sensor.destroy()
+		if self.camera_manager is not None:
+			self.camera_manager.stop_processing()
 		if self.player is not None:
 			self.player.destroy()
 
 
+# ==============================================================================
+# -- SynchronousDriver ---------------------------------------------------------
+# ==============================================================================
+
+
+class SynchronousDriver(object):
+	"""
+	Runs the world in synchronous mode with fixed delta_seconds and advances it
+	in lockstep with the balancer: every step ticks the world, waits for the
+	imu sample of that tick and for the steer-angle calculated from it.
+	"""
+	def __init__(self, client, world, transport, delta_seconds, timeout):
+		self._world = world
+		self._transport = transport
+		self._timeout = timeout
+		self._original_settings = world.world.get_settings()
+		settings = world.world.get_settings()
+		settings.synchronous_mode = True
+		settings.fixed_delta_seconds = delta_seconds
+		world.world.apply_settings(settings)
+		self._traffic_manager = client.get_trafficmanager()
+		self._traffic_manager.set_synchronous_mode(True)
+		self.missed_samples = 0
+		self.missed_replies = 0
+
+	def step(self):
+		frame = self._world.world.tick(self._timeout)
+		sample_id = self._world.imu_sensor.wait_for_frame(frame, self._timeout)
+		if sample_id is None:
+			self.missed_samples += 1
+		elif not self._transport.waitForReply(sample_id, self._timeout):
+			self.missed_replies += 1
+		return frame
+
+	def destroy(self):
+		self._traffic_manager.set_synchronous_mode(False)
+		self._world.world.apply_settings(self._original_settings)
+
+
 # ==============================================================================
 # -- KeyboardControl -----------------------------------------------------------
 # ==============================================================================
@@ -487,6 +542,10 @@ class HUD(object):
 		self._show_info = True
 		self._info_text = []
 		self._server_clock = pygame.time.Clock()
+		self._latency_monitor = None
+
+	def set_latency_monitor(self, latency_monitor):
+		self._latency_monitor = latency_monitor
 
 	def on_world_tick(self, timestamp):
 		self._server_clock.tick()
@@ -494,6 +553,23 @@ class HUD(object):
 		self.frame = timestamp.frame
 		self.simulation_time = timestamp.elapsed_seconds
 
+	def render(self, display):
+		if not self._show_info or self._latency_monitor is None:
+			return
+		summary = self._latency_monitor.summary
+		if summary is None or not summary['count']:
+			return
+		self._info_text = [
+			'Control loop RTT (%d/s)' % round(summary['count'] / self._latency_monitor.period),
+			'p50 %7.2f ms' % summary['p50'],
+			'p95 %7.2f ms' % summary['p95'],
+			'p99 %7.2f ms' % summary['p99'],
+			'max %7.2f ms' % summary['max']]
+		v_offset = 4
+		for item in self._info_text:
+			surface = self._font_mono.render(item, True, (255, 255, 255))
+			display.blit(surface, (8, v_offset))
+			v_offset += 18
 
 
 # ==============================================================================
@@ -501,15 +577,19 @@ class HUD(object):
 # ==============================================================================
 
 class IMUSensor(object):
-	def __init__(self, parent_actor, qForSendingImuDataToBalancerModule):
+	def __init__(self, parent_actor, qForSendingImuDataToBalancerModule, serializer, sensor_tick='0.1'):
 		self.sensor = None
 		self._parent = parent_actor
+		self._serializer = serializer
+		self._sequence = 0
+		self._last_frame = -1
+		self._sample_condition = threading.Condition()
 		self.accelerometer = (0.0, 0.0, 0.0)
 		self.gyroscope = (0.0, 0.0, 0.0)
 		self.compass = 0.0
 		world = self._parent.get_world()
 		bp = world.get_blueprint_library().find('sensor.other.imu')
-		bp.set_attribute('sensor_tick', "0.1")
+		bp.set_attribute('sensor_tick', sensor_tick)
 		self.sensor = world.spawn_actor(
 			bp, carla.Transform(), attach_to=self._parent)
 		# We need to pass the lambda a weak reference to self to avoid circular
@@ -535,21 +615,19 @@ class IMUSensor(object):
 		self.compass = math.degrees(sensor_data.compass)
 
 		velocity = self._parent.get_velocity()
-		accelerometerData = sensor_data.accelerometer
-		gyroscopeData     = sensor_data.gyroscope
-		sendData = {"accel": {"x": round(accelerometerData.x, 4), 
-							  "y": round(accelerometerData.y, 4), 
-							  "z": round(accelerometerData.z, 4)}, 
-					"gyro":  {"x": round(gyroscopeData.x, 4), 
-							  "y": round(gyroscopeData.y, 4), 
-							  "z": round(gyroscopeData.z, 4)},
-					"velocity": {"x":  round(velocity.x, 4),
-								 "y":  round(velocity.y, 4),
-								 "z":  round(velocity.z, 4)}
-					}
-		print(sendData)
-		sendDataJson = json.dumps(sendData)
-		qForSendingImuDataToBalancerModule.put(sendDataJson)
+		self._sequence = (self._sequence + 1) & 0xFFFFFFFF
+		sendData = self._serializer.serialize(self._sequence, sensor_data, velocity)
+		qForSendingImuDataToBalancerModule.put(sendData, self._sequence)
+		with self._sample_condition:
+			self._last_frame = sensor_data.frame
+			self._sample_condition.notify_all()
+
+	def wait_for_frame(self, frame, timeout):
+		"""Waits for sample of given (or later) frame. Returns its id or None on timeout."""
+		with self._sample_condition:
+			if not self._sample_condition.wait_for(lambda: self._last_frame >= frame, timeout):
+				return None
+			return self._sequence
 
 
 # ==============================================================================
@@ -558,9 +636,19 @@ class IMUSensor(object):
 
 
 class CameraManager(object):
-	def __init__(self, parent_actor, hud, gamma_correction):
+	def __init__(self, parent_actor, hud, gamma_correction, workers=1, new_recorder=FrameRecorder):
 		self.sensor = None
 		self.surface = None
+		self._new_recorder = new_recorder
+		self._recorder = None
+		# Preallocated surfaces camera frames are written into in turn:
+		# one is shown, while others receive next frames (one per worker).
+		self._workers = max(1, workers)
+		self._frame_surfaces = []
+		self._frame_surface_index = 0
+		self._frame_surfaces_lock = threading.Lock()
+		self._shown_frame = -1
+		self._processor = FrameProcessor(self._decode_frame, self._on_frame_decoded, self._workers)
 		self._parent = parent_actor
 		self.hud = hud
 		self.recording = False
@@ -649,18 +737,73 @@ class CameraManager(object):
 		self.set_sensor(self.index + 1)
 
 	def toggle_recording(self):
-		self.recording = not self.recording
+		if self.recording:
+			self.recording = False
+			self._recorder.stop()
+			print('Recording stopped: ', self._recorder.stats())
+			self._recorder = None
+		else:
+			self._recorder = self._new_recorder()
+			self._recorder.start()
+			print('Recording frames to %s' % self._recorder.path)
+			self.recording = True
 
 	def render(self, display):
 		if self.surface is not None:
 			display.blit(self.surface, (0, 0))
 
+	def _next_frame_surface(self, width, height):
+		"""
+		Returns preallocated surface, which pixel layout matches BGRA bytes
+		of carla.Image, or None, if such surface can't be used.
+		"""
+		with self._frame_surfaces_lock:
+			if not self._frame_surfaces or self._frame_surfaces[0].get_size() != (width, height):
+				# 0x00RRGGBB pixels are stored as B, G, R, X bytes on little-endian hosts.
+				masks = (0x00FF0000, 0x0000FF00, 0x000000FF, 0)
+				self._frame_surfaces = [pygame.Surface((width, height), 0, 32, masks)
+										for _ in range(self._workers + 2)]
+			if sys.byteorder != 'little' or self._frame_surfaces[0].get_pitch() != width * 4:
+				return None
+			self._frame_surface_index = (self._frame_surface_index + 1) % len(self._frame_surfaces)
+			return self._frame_surfaces[self._frame_surface_index]
+
+	def stop_processing(self):
+		self._processor.stop()
+		if self.recording:
+			self.toggle_recording()
+
 	@staticmethod
 	def _parse_image(weak_self, image):
 		self = weak_self()
 		if not self:
 			return
-		if self.sensors[self.index][0].startswith('sensor.lidar'):
+		# Runs in sensor`s callback thread: decoding is left to frame processor
+		# and writing to frame recorder, every frame is recorded.
+		recorder = self._recorder
+		converted = False
+		if recorder is not None:
+			sensor, converter = self.sensors[self.index][0], self.sensors[self.index][1]
+			if sensor.startswith('sensor.lidar'):
+				recorder.submit(image.frame, sensor, 0, 0, image.raw_data, points=len(image))
+			else:
+				if sensor.startswith('sensor.camera') and not sensor.startswith('sensor.camera.dvs'):
+					# Recorded frame has colours of view (as save_to_disk had).
+					image.convert(converter)
+					converted = True
+				recorder.submit(image.frame, sensor, image.width, image.height, image.raw_data)
+		self._processor.submit(image.frame, (self.index, image, converted))
+
+	def _on_frame_decoded(self, frame_id, surface):
+		with self._frame_surfaces_lock:
+			if frame_id < self._shown_frame:
+				return # newer frame was decoded by another worker.
+			self._shown_frame = frame_id
+			self.surface = surface
+
+	def _decode_frame(self, frame):
+		index, image, converted = frame
+		if self.sensors[index][0].startswith('sensor.lidar'):
 			points = np.frombuffer(image.raw_data, dtype=np.dtype('f4'))
 			points = np.reshape(points, (int(points.shape[0] / 4), 4))
 			lidar_data = np.array(points[:, :2])
@@ -672,8 +815,8 @@ class CameraManager(object):
 			lidar_img_size = (self.hud.dim[0], self.hud.dim[1], 3)
 			lidar_img = np.zeros((lidar_img_size), dtype=np.uint8)
 			lidar_img[tuple(lidar_data.T)] = (255, 255, 255)
-			self.surface = pygame.surfarray.make_surface(lidar_img)
-		elif self.sensors[self.index][0].startswith('sensor.camera.dvs'):
+			surface = pygame.surfarray.make_surface(lidar_img)
+		elif self.sensors[index][0].startswith('sensor.camera.dvs'):
 			# Example of converting the raw_data from a carla.DVSEventArray
 			# sensor into a NumPy array and using it as an image
 			dvs_events = np.frombuffer(image.raw_data, dtype=np.dtype([
@@ -681,16 +824,27 @@ class CameraManager(object):
 			dvs_img = np.zeros((image.height, image.width, 3), dtype=np.uint8)
 			# Blue is positive, red is negative
 			dvs_img[dvs_events[:]['y'], dvs_events[:]['x'], dvs_events[:]['pol'] * 2] = 255
-			self.surface = pygame.surfarray.make_surface(dvs_img.swapaxes(0, 1))
+			surface = pygame.surfarray.make_surface(dvs_img.swapaxes(0, 1))
 		else:
-			image.convert(self.sensors[self.index][1])
-			array = np.frombuffer(image.raw_data, dtype=np.dtype("uint8"))
-			array = np.reshape(array, (image.height, image.width, 4))
-			array = array[:, :, :3]
-			array = array[:, :, ::-1]
-			self.surface = pygame.surfarray.make_surface(array.swapaxes(0, 1))
-		if self.recording:
-			image.save_to_disk('_out/%08d' % image.frame)
+			if not converted:
+				image.convert(self.sensors[index][1])
+			surface = self._next_frame_surface(image.width, image.height)
+			if surface is not None:
+				# Single copy of BGRA bytes straight into surface pixels.
+				# Pixels view must be released before surface is blitted.
+				with memoryview(surface.get_buffer()) as pixels:
+					pixels[:] = memoryview(image.raw_data).cast('B')
+			else:
+				surface = self._make_surface_from_bgra(image)
+		return surface
+
+	@staticmethod
+	def _make_surface_from_bgra(image):
+		array = np.frombuffer(image.raw_data, dtype=np.dtype("uint8"))
+		array = np.reshape(array, (image.height, image.width, 4))
+		array = array[:, :, :3]
+		array = array[:, :, ::-1]
+		return pygame.surfarray.make_surface(array.swapaxes(0, 1))
 
 
 # ==============================================================================
@@ -698,9 +852,15 @@ class CameraManager(object):
 # ==============================================================================
 
 def game_loop(args):
+	if args.headless:
+		headless_loop(args)
+		return
+
 	pygame.init()
 	pygame.font.init()
 	world = None
+	transport = None
+	sync_driver = None
 
 	try:
 		client = carla.Client(args.carla_ip, args.carla_port)
@@ -713,25 +873,39 @@ def game_loop(args):
 		pygame.display.flip()
 
 		hud = HUD(args.width, args.height)
-		qForSendingImuDataToBalancerModule = Queue()
-		world = World(client.get_world(), hud, args, qForSendingImuDataToBalancerModule)
+		# transport is the queue for imu data: IMU callback puts serialized samples into it.
+		transport = Transport(args)
+		hud.set_latency_monitor(transport.latency)
+		world = World(client.get_world(), hud, args, transport)
 		controller = KeyboardControl(world, args.autopilot)
-#
-		sendThread = threading.Thread(target=sendImuDataToRemoteServer_THREAD, args=(qForSendingImuDataToBalancerModule, args))
-		sendThread.start()
 
-		receivedThread = threading.Thread(target=ReceiveSteerWheelAngleFromRemoteServer_THREAD, args=(args, world.player))
-		receivedThread.start()
+		transport.start(lambda: world.player)
+		if args.sync:
+			sync_driver = SynchronousDriver(client, world, transport, args.delta_seconds, args.sync_timeout)
 
-		motorbike = world.player
 		clock = pygame.time.Clock()
 		while True:
-			clock.tick_busy_loop(60)
+			if sync_driver is not None:
+				# Pace is defined by the balancer, not by wall clock.
+				sync_driver.step()
+				clock.tick()
+			else:
+				clock.tick_busy_loop(60)
 			if controller.parse_events(client, world, clock):
 				return
 			world.render(display)
+			hud.render(display)
 			pygame.display.flip()
 	finally:
+		if transport is not None:
+			transport.shutdown()
+			print("imu queue: ", transport.imuQueue.stats())
+
+		if sync_driver is not None:
+			print("synchronous mode: missed imu samples: %d, missed steer replies: %d" % (
+				sync_driver.missed_samples, sync_driver.missed_replies))
+			sync_driver.destroy()
+
 		if (world and world.recording_enabled):
 			client.stop_recorder()
 
@@ -741,6 +915,62 @@ def game_loop(args):
 		pygame.quit()
 
 
+# ==============================================================================
+# -- headless_loop() -----------------------------------------------------------
+# ==============================================================================
+
+def headless_loop(args):
+	"""
+	Pure control server: no pygame window, no camera and no server-side
+	rendering. Only imu pipeline and steer-angle receiver are running.
+	Stops on Ctrl+C.
+	"""
+	world = None
+	transport = None
+	sync_driver = None
+	original_settings = None
+
+	try:
+		client = carla.Client(args.carla_ip, args.carla_port)
+		client.set_timeout(5.0)
+		carla_world = client.get_world()
+
+		original_settings = carla_world.get_settings()
+		settings = carla_world.get_settings()
+		settings.no_rendering_mode = True
+		carla_world.apply_settings(settings)
+
+		transport = Transport(args)
+		world = World(carla_world, None, args, transport)
+		if args.autopilot:
+			world.player.set_autopilot(True)
+
+		transport.start(lambda: world.player)
+		if args.sync:
+			sync_driver = SynchronousDriver(client, world, transport, args.delta_seconds, args.sync_timeout)
+
+		while True:
+			if sync_driver is not None:
+				sync_driver.step()
+			else:
+				carla_world.wait_for_tick()
+	finally:
+		if transport is not None:
+			transport.shutdown()
+			print("imu queue: ", transport.imuQueue.stats())
+
+		if sync_driver is not None:
+			print("synchronous mode: missed imu samples: %d, missed steer replies: %d" % (
+				sync_driver.missed_samples, sync_driver.missed_replies))
+			sync_driver.destroy()
+
+		if original_settings is not None:
+			carla_world.apply_settings(original_settings)
+
+		if world is not None:
+			world.destroy()
+
+
 # ==============================================================================
 # -- main() --------------------------------------------------------------------
 # ==============================================================================
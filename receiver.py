@@ -1,13 +1,15 @@
-import socket
-import json
+import asyncio
 import carla
-import random
+from steerAngleDecoder import SteerAngleDecoder, RECV_BUFFER_SIZE
+from reconnectBackoff import ReconnectBackoff
 
 '''
 * @author: vladddd46
-* @brief:  Server thread, which receives data(steer-wheel angle)
-* 		   from remote client(ip=args.rip:args.rport) and sends it via
-* 		   queue to simulationEntryPoint in order to change angle of steer-wheel.
+* @brief:  Steer-angle downlink. Server, which receives data(steer-wheel angle)
+* 		   from remote client(ip=args.rip:args.rport) and applies it to
+* 		   motorbike in order to change angle of steer-wheel.
+* 		   Messages are newline-delimited json (see steerAngleDecoder.py).
+* 		   Runs in transport`s event loop.
 '''
 
 
@@ -17,35 +19,50 @@ def setCenterOfVehicleMass(vehicle, x, y, z):
 	vehicle.apply_physics_control(physics_control)
 
 
+class SteerAngleProtocol(asyncio.BufferedProtocol):
+	'''
+	One instance per balancer connection. Bytes are received straight
+	into preallocated buffer, so there are no allocations per recv.
+	'''
+	def __init__(self, onSteerWheelAngle):
+		self._onSteerWheelAngle = onSteerWheelAngle
+		self._decoder    = SteerAngleDecoder()
+		self._recvBuffer = bytearray(RECV_BUFFER_SIZE)
+		self._recvView   = memoryview(self._recvBuffer)
 
+	def get_buffer(self, sizehint):
+		return self._recvBuffer
 
-def ReceiveSteerWheelAngleFromRemoteServer_THREAD(parsedArgs, motorbike):
-	sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-	sock.bind((parsedArgs.rip, parsedArgs.rport))
-	sock.listen()
-	
-	# sendSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-	# sendSocket.connect(("127.0.0.1", 7778))
+	def buffer_updated(self, nbytes):
+		message = self._decoder.feed(self._recvView[:nbytes])
+		if message is None:
+			return
+		try:
+			self._onSteerWheelAngle(*message)
+		except Exception as e:
+			print(e)
 
-	y = 0
+	def connection_lost(self, exc):
+		self._decoder.reset()
+
+
+def applySteerWheelAngle(motorbike, steerWheelAngle):
+	motorbike.apply_control(carla.VehicleControl(throttle=0, steer=steerWheelAngle))
+	# setCenterOfVehicleMass(motorbike, 0, y, 0)
+
+
+async def receiveSteerWheelAngleFromRemoteServer(parsedArgs, onSteerWheelAngle):
+	loop = asyncio.get_running_loop()
+	backoff = ReconnectBackoff()
 	while True:
-		connectionSocket, addr = sock.accept()
-		with connectionSocket:
-			while True:
-				data = connectionSocket.recv(1024)
-				try:
-					if not data:
-						break
-					data = data.decode("ascii")
-					parsedData = json.loads(data)
-					steerWheelAngle = parsedData["angle"]
-					# sendSocket.sendall(bytes(str(steerWheelAngle), 'utf-8'))
-					motorbike.apply_control(carla.VehicleControl(throttle=0, steer=float(steerWheelAngle)))
-					y += 0.1
-					# setCenterOfVehicleMass(motorbike, 0, y, 0)
-					data = ""
-				except Exception as e:
-					print(e)
-					pass
-	sock.close()
-	# sendSocket.close()
\ No newline at end of file
+		try:
+			server = await loop.create_server(
+				lambda: SteerAngleProtocol(onSteerWheelAngle),
+				parsedArgs.rip, parsedArgs.rport)
+			break
+		except OSError as e:
+			print("Exception while starting steer-angle server: ", e)
+			await asyncio.sleep(backoff.next())
+
+	async with server:
+		await server.serve_forever()
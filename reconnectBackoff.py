@@ -0,0 +1,23 @@
+'''
+* @author: vladddd46
+* @brief:  Exponential backoff between reconnection attempts.
+*          Delay starts from `initial` seconds, is multiplied by `factor`
+*          after every failed attempt and never exceeds `maximum`.
+*          Successful connection must call reset().
+'''
+
+
+class ReconnectBackoff(object):
+	def __init__(self, initial=0.1, maximum=5.0, factor=2.0):
+		self._initial = initial
+		self._maximum = maximum
+		self._factor  = factor
+		self._delay   = initial
+
+	def next(self):
+		delay = self._delay
+		self._delay = min(self._maximum, self._delay * self._factor)
+		return delay
+
+	def reset(self):
+		self._delay = self._initial
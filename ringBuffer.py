@@ -0,0 +1,105 @@
+import asyncio
+import collections
+import time
+
+'''
+* @author: vladddd46
+* @brief:  Bounded handoff of IMU samples from sensor`s callback thread
+*          to IMU uplink coroutine (transport`s event loop).
+*          Policies:
+*          - drop_oldest - keeps up to `capacity` newest samples; when buffer
+*                          is full, the oldest sample is overwritten.
+*          - latest_only - keeps only the newest sample (capacity is 1).
+*          put() and pop() do not take locks: they rely on append()/popleft()
+*          of bounded collections.deque being atomic. Counters are
+*          statistics and may be off by one under contention.
+'''
+
+POLICY_DROP_OLDEST = 'drop_oldest'
+POLICY_LATEST_ONLY = 'latest_only'
+POLICIES           = (POLICY_DROP_OLDEST, POLICY_LATEST_ONLY)
+
+
+class RingBuffer(object):
+	def __init__(self, capacity=64, policy=POLICY_DROP_OLDEST):
+		if policy == POLICY_LATEST_ONLY:
+			capacity = 1
+		if capacity < 1:
+			raise ValueError("Capacity of ring buffer must be positive: %d" % capacity)
+		self.capacity = capacity
+		self.policy   = policy
+		self._entries = collections.deque(maxlen=capacity)
+		# Consumer side. Set by get(), when consumer sleeps on empty buffer.
+		self._loop    = None
+		self._event   = None
+		self._waiting = False
+		# Statistics.
+		self.puts          = 0
+		self.overruns      = 0
+		self.sent          = 0
+		self.maxDepth      = 0
+		self.latencySum    = 0.0
+		self.latencyMax    = 0.0
+
+	def __len__(self):
+		return len(self._entries)
+
+	def put(self, data):
+		'''May be called from any thread.'''
+		entries = self._entries
+		if len(entries) == self.capacity:
+			self.overruns += 1
+		entries.append((time.perf_counter(), data))
+		self.puts += 1
+		depth = len(entries)
+		if depth > self.maxDepth:
+			self.maxDepth = depth
+		if self._waiting:
+			try:
+				self._loop.call_soon_threadsafe(self._event.set)
+			except RuntimeError:
+				pass # event loop is already closed.
+
+	def pop(self):
+		'''Returns (enqueuedAt, data) of the oldest sample or None.'''
+		try:
+			return self._entries.popleft()
+		except IndexError:
+			return None
+
+	async def get(self):
+		'''Waits for the oldest sample. Must be awaited from single consumer.'''
+		if self._event is None:
+			self._loop  = asyncio.get_running_loop()
+			self._event = asyncio.Event()
+		while True:
+			entry = self.pop()
+			if entry is not None:
+				return entry
+			self._event.clear()
+			self._waiting = True
+			# Producer might have put sample before it saw _waiting.
+			entry = self.pop()
+			if entry is not None:
+				self._waiting = False
+				return entry
+			await self._event.wait()
+			self._waiting = False
+
+	def markSent(self, enqueuedAt):
+		latency = time.perf_counter() - enqueuedAt
+		self.sent += 1
+		self.latencySum += latency
+		if latency > self.latencyMax:
+			self.latencyMax = latency
+
+	def stats(self):
+		return {"policy":         self.policy,
+				"capacity":       self.capacity,
+				"depth":          len(self._entries),
+				"maxDepth":       self.maxDepth,
+				"puts":           self.puts,
+				"overruns":       self.overruns,
+				"sent":           self.sent,
+				"avgLatencyMs":   1000.0 * self.latencySum / self.sent if self.sent else 0.0,
+				"maxLatencyMs":   1000.0 * self.latencyMax}
@@ -1,28 +1,31 @@
-import socket
-import time
+import asyncio
+from reconnectBackoff import ReconnectBackoff
 
 '''
 * @author: vladddd46
-* @brief:  Sender thread. Gets IMU sensor`s data from queue 
-*          and sends it via socket to remote server. 
+* @brief:  IMU uplink. Gets IMU sensor`s data from ring buffer
+*          and sends it via socket to remote server.
+*          Runs as coroutine in transport`s event loop.
 '''
 
-def sendImuDataToRemoteServer_THREAD(q, parsedArgs):
+async def sendImuDataToRemoteServer(q, parsedArgs):
+	backoff = ReconnectBackoff()
 	while True:
 		try:
-			sendSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-			sendSocket.connect((parsedArgs.sip, parsedArgs.sport))
-		except  Exception as e:
+			reader, writer = await asyncio.open_connection(parsedArgs.sip, parsedArgs.sport)
+		except OSError as e:
 			print("Exception while creating and connecting socket: ", e)
-			time.sleep(1)
+			await asyncio.sleep(backoff.next())
+			continue
+		backoff.reset()
 
-		while True:
-			try:
-				dataToSend = q.get() # getting imu data in json format as str.
-				sendSocket.sendall(bytes(dataToSend, 'utf-8')) # sending data to balancer.
-			except Exception as e:
-				break
 		try:
-			sendSocket.close()
-		except:
-			pass
\ No newline at end of file
+			while True:
+				enqueuedAt, dataToSend = await q.get() # getting serialized imu data as bytes.
+				writer.write(dataToSend)               # sending data to balancer.
+				await writer.drain()
+				q.markSent(enqueuedAt)
+		except (OSError, ConnectionError) as e:
+			print("Connection with balancer is lost: ", e)
+		finally:
+			writer.close()
@@ -0,0 +1,73 @@
+import json
+
+'''
+* @author: vladddd46
+* @brief:  Incremental decoder of steer-angle stream, received from remote
+*          server. Every message is json object with "angle" key, terminated
+*          by MESSAGE_DELIMITER (newline-delimited json):
+*
+*              {"angle": 0.12}\n{"angle": 0.11}\n
+*
+*          TCP may split one message between several recv() calls or put
+*          several messages into one, so received bytes are accumulated in
+*          reusable buffer and only complete messages are parsed. From every
+*          portion of stream only the newest valid angle is returned, so
+*          stale backlog is never applied to motorbike.
+*          Optional "id" key echoes id of IMU sample, steer-angle was
+*          calculated from (see latencyMonitor.py).
+'''
+
+MESSAGE_DELIMITER = b'\n'
+RECV_BUFFER_SIZE  = 4096
+# Protection from peer, which never sends delimiter.
+MAX_PENDING_BYTES = 64 * 1024
+
+
+class SteerAngleDecoder(object):
+	def __init__(self):
+		self._pending  = bytearray()
+		self.received  = 0 # count of complete messages.
+		self.skipped   = 0 # count of messages, replaced by newer ones.
+		self.malformed = 0 # count of messages, which could not be parsed.
+
+	def feed(self, data):
+		'''
+		Appends received bytes to stream.
+		Returns (angle, id) of newest message completed by these bytes or
+		None, if there are no complete valid messages. id is None, if
+		message does not carry it.
+		'''
+		self._pending += data
+		end = self._pending.rfind(MESSAGE_DELIMITER)
+		if end < 0:
+			if len(self._pending) > MAX_PENDING_BYTES:
+				self.malformed += 1
+				del self._pending[:]
+			return None
+
+		messages = bytes(self._pending[:end]).split(MESSAGE_DELIMITER)
+		del self._pending[:end + len(MESSAGE_DELIMITER)]
+		self.received += len(messages)
+
+		# Walk from newest message to oldest: older ones are not needed,
+		# as soon as newest valid angle is found.
+		for i in range(len(messages) - 1, -1, -1):
+			message = messages[i].strip()
+			if not message:
+				continue
+			try:
+				parsedData = json.loads(message)
+				angle = float(parsedData["angle"])
+				messageId = parsedData.get("id")
+				if messageId is not None:
+					messageId = int(messageId)
+			except (ValueError, KeyError, TypeError, AttributeError) as e:
+				self.malformed += 1
+				print("Malformed steer-angle message: ", message, e)
+				continue
+			self.skipped += i
+			return angle, messageId
+		return None
+
+	def reset(self):
+		del self._pending[:]
@@ -0,0 +1,110 @@
+import asyncio
+import threading
+from sender        import sendImuDataToRemoteServer
+from receiver      import receiveSteerWheelAngleFromRemoteServer, applySteerWheelAngle
+from drawerSender  import DrawerChannel, sendAnglesToDrawer
+from ringBuffer    import RingBuffer
+from latencyMonitor import LatencyMonitor
+
+'''
+* @author: vladddd46
+* @brief:  Transport core. One thread with asyncio event loop owns all links
+*          with outer world:
+*          - IMU uplink        (sender.py)       - to balancer (args.sip:args.sport)
+*          - steer downlink    (receiver.py)     - from balancer (args.rip:args.rport)
+*          - drawer link       (drawerSender.py) - to drawer (args.drawer_ip:args.drawer_port),
+*                                                  only if args.drawer_on is set.
+*          Links reconnect with exponential backoff without blocking each other.
+*          put() may be called from any thread (e.g. from IMU sensor`s callback):
+*          samples are passed to uplink via bounded ring buffer (ringBuffer.py).
+*          Round trip from IMU sample to applied steer-angle is measured by
+*          latencyMonitor.py.
+*          shutdown() stops all links and joins the thread.
+'''
+
+
+class Transport(object):
+	def __init__(self, parsedArgs):
+		self._args     = parsedArgs
+		self._loop     = None
+		self._thread   = None
+		self.imuQueue  = RingBuffer(parsedArgs.imu_queue_size, parsedArgs.imu_queue_policy)
+		self.latency   = LatencyMonitor(parsedArgs.latency_csv, parsedArgs.latency_period)
+		self._drawer   = None
+		self._stopped  = None
+		self._ready    = threading.Event()
+		self._getMotorbike = None
+		self._lastAppliedId = None
+		self._replyCondition = threading.Condition()
+
+	def start(self, getMotorbike):
+		'''
+		getMotorbike - callable, which returns actor steer-angles must be
+		applied to (motorbike may be respawned while transport is running).
+		'''
+		self._getMotorbike = getMotorbike
+		self._thread = threading.Thread(target=self._run, name="transport", daemon=True)
+		self._thread.start()
+		self._ready.wait()
+
+	def put(self, data, sampleId=None):
+		if sampleId is not None:
+			self.latency.stamp(sampleId)
+		self.imuQueue.put(data)
+
+	def waitForReply(self, sampleId, timeout):
+		'''
+		Waits until steer-angle for given (or later) imu sample is applied.
+		Returns False on timeout. Ids wrap around at 2^32.
+		'''
+		def replied():
+			return self._lastAppliedId is not None and \
+				((self._lastAppliedId - sampleId) & 0xFFFFFFFF) < 0x80000000
+		with self._replyCondition:
+			return self._replyCondition.wait_for(replied, timeout)
+
+	def shutdown(self, timeout=2.0):
+		loop = self._loop
+		if loop is not None:
+			try:
+				loop.call_soon_threadsafe(self._stopped.set)
+			except RuntimeError:
+				pass
+		if self._thread is not None:
+			self._thread.join(timeout)
+			self._thread = None
+
+	def _run(self):
+		try:
+			asyncio.run(self._main())
+		finally:
+			self._loop = None
+			self._ready.set()
+
+	def _onSteerWheelAngle(self, steerWheelAngle, sampleId=None):
+		applySteerWheelAngle(self._getMotorbike(), steerWheelAngle)
+		if sampleId is not None:
+			self.latency.complete(sampleId)
+			with self._replyCondition:
+				self._lastAppliedId = sampleId
+				self._replyCondition.notify_all()
+		if self._drawer is not None:
+			self._drawer.publish(steerWheelAngle)
+
+	async def _main(self):
+		self._stopped  = asyncio.Event()
+		tasks = [
+			asyncio.ensure_future(sendImuDataToRemoteServer(self.imuQueue, self._args)),
+			asyncio.ensure_future(receiveSteerWheelAngleFromRemoteServer(self._args, self._onSteerWheelAngle)),
+			asyncio.ensure_future(self.latency.run())]
+		if self._args.drawer_on:
+			self._drawer = DrawerChannel()
+			tasks.append(asyncio.ensure_future(sendAnglesToDrawer(self._drawer, self._args)))
+		self._loop = asyncio.get_running_loop()
+		self._ready.set()
+
+		await self._stopped.wait()
+		self._loop = None
+		for task in tasks:
+			task.cancel()
+		await asyncio.gather(*tasks, return_exceptions=True)